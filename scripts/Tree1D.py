@@ -2,7 +2,8 @@ from graphviz import Digraph
 import numpy as np
 import logging
 
-from scripts import reclusterTree
+from scripts import reclusterCache
+from scripts import traversal
 from scripts.utils import get_logger
 
 logger = get_logger(level=logging.INFO)
@@ -16,6 +17,7 @@ def plotBinaryTree(
 		pTSort = False,
 		truthOrder = None,
 		figFormat = "pdf",
+		collapse = None,
 ):
 	'''
 	Plot a tree with nodes and edges using graphviz Digraph
@@ -28,6 +30,8 @@ def plotBinaryTree(
 	- pySort: sort leaves in increasing py.
 	- pTSort: sort leaves in increasing pT=abs(py).
 	- truthOrder: Bool. If True, then use the truth tree to order the leaves.
+	- collapse: (optional) dictionary with the thresholds of collapseTree, e.g. {"min_leaves": 10}. Each subtree below the
+	  thresholds is drawn as a single summary node (grey), with its number of leaves and total momentum.
 
 	'''
 
@@ -35,7 +39,7 @@ def plotBinaryTree(
 
 	arrowsize = "0.1"
 
-	# Dot will be the tree graph
+	# Dot will be the tree graph. Each node and edge is written once, with all its attributes.
 	dot = Digraph(
 		graph_attr={"rank": "flow"},
 		edge_attr={"arrowsize": arrowsize},
@@ -43,160 +47,52 @@ def plotBinaryTree(
 		format=figFormat,
 	)
 
-
-	# Create a subgraph to plot all the leaves at the same level.
-	# Connect all the leaves with invisible edges to fix the leaves order within different trees.
-	leaves = Digraph(edge_attr={"arrowsize": arrowsize, "style": "invis"})
-
-	# Plot all the leaves at the same level
-	leaves.attr(rank='same')
-
 	########################
-	outers = []
-	# Recursive function to build the graph
-	def _rec(jet, parent, node_id):
-
-		# Add a label to each node
-		if label:
-			if "deltas" in jet.keys() and jet["deltas"][node_id] >= 0.:
-				node_label = "py:%0.1f\n pz:%0.1f\n &#916;:%0.2f " % (jet["content"][node_id][0],
-				                                                      jet["content"][node_id][1],
-				                                                      jet["deltas"][node_id])
-			else:
-				node_label = "py:%0.1f\n pz:%0.1f" % (jet["content"][node_id][0],
-				                                      jet["content"][node_id][1])
+	# Traverse the tree (without recursion) to get the parent of each node and the leaves in order
+	jet, (preorder, leaves, parent, depth, children), outers = _displayTree(jet, node_id_in, pySort, pTSort, truthOrder, collapse)
 
-		else:
-			node_label = ''""
 
+	########################
+	# Build the graph
+	for node_id in preorder.tolist():
 
-		# Define the subgraph for each recursive call
-		sub = Digraph(
-			node_attr={"fixedsize": "true",
-			           "label": str(node_label),
-			           "height": "0.1",
-			           "width": "0.1",
-			           "style": "filled",
-			           "fontsize": "22.0", },
-			edge_attr={"arrowsize": arrowsize,
-			           "minlen": "0.1"},
-		)
+		node_label = _nodeLabel(jet, node_id) if label else ''""
 
-		# Nodes size and color
-		size = "1.25"
-		node_color = "lightblue" if jet["tree"][node_id, 0] == -1 else "wheat"
+		# Nodes size and color. Leaves are smaller when they are plotted at the same level (more than 1 leaf)
+		node_color = _nodeColor(jet, node_id)
+		if jet["tree"][node_id, 0] != -1:
+			size, fontsize = "1.25", "22.0"
+		elif len(outers) > 1:
+			size, fontsize = "0.8", "17.0"
+		else:
+			size, fontsize = "1.25", "22.0"
 
 		# Add node
-		sub.node("%d" % node_id,
+		dot.node("%d" % node_id,
+		         label=str(node_label),
+		         fixedsize="true",
 		         width=size,
 		         height=size,
 		         shape="circle",
-		         color=node_color)
-
-
-		# Add leaves to outers list
-		if jet["tree"][node_id, 0] == -1:
-			outers.append(node_id)
-
-		# Add subgraph to main graph
-		dot.subgraph(sub)
-
+		         color=node_color,
+		         fontsize=fontsize)
 
 		# Draw from root to leaves. Connect child to parent node. (1st entry is parent, 2nd entry is child)
-		if parent >= 0:
-			dot.edge("%d" % parent,
+		if parent[node_id] >= 0:
+			dot.edge("%d" % parent[node_id],
 			         "%d" % node_id,
 			         color="black")
 
-		# Recursive calls
-		if jet["tree"][node_id, 0] != -1:
-
-			_rec(jet,
-			     node_id,
-			     jet["tree"][node_id, 0],
-			     )
-
-			_rec(jet,
-			     node_id,
-			     jet["tree"][node_id, 1],
-			     )
-
-
-	########################
-	# Run the recursive function
-	_rec(jet, -1, jet["root_id"])
-
-
-	# Sort the leaves to match the order in which they are accessed when traverseing a tree from some other clustering algorithm (or truth jet).
-	# The order is in node_id_in.
-	if node_id_in:
-		if not truthOrder and jet["algorithm"] == "truth":
-			outers = [outers[k] for k in node_id_in]
-		else:
-			new_idx_list = list(zip(outers, node_id_in))
-			logger.debug(f"new_idx_list before sorting=  {new_idx_list}")
-			new_idx_list = sorted(new_idx_list,
-			                      key=lambda x: x[1])  # Sort according to node_id_in.
-			logger.debug(f"new_idx_list after sorting=  {new_idx_list}")
-			outers = [x for (x, y) in new_idx_list]  # List the node ids in the new order.
-
-
-	# Sort the leaves in increasing py. (Also commnent/uncomment ptList line below to use absolute value)
-	if pySort:
-		ptList = [jet["content"][node_id][0] for node_id in outers]
-	elif pTSort:
-		ptList=[np.absolute(jet["content"][node_id][0]) for node_id in outers]
-
-	if pySort or pTSort:
-		new_idx_list = list(zip(outers, ptList))
-		logger.debug(f"new_idx_list before sorting=  {new_idx_list}")
-		new_idx_list = sorted(new_idx_list,
-		                      key=lambda x: x[1])
-		logger.debug(f"new_idx_list after sorting=  {new_idx_list}")
-
-		outers = [x for (x, y) in new_idx_list]  # List the node ids in the new order.
-		logger.debug(f"outers after= {outers}")
-
-
-	# Add leaf nodes to the leaves digraph in the new order
-	size = "0.8"
-	node_color = "lightblue"
-
-	sub_leaf = Digraph(
-		node_attr={"fixedsize": "true",
-		           "height": "0.1",
-		           "width": "0.1",
-		           "style": "filled"},
-		edge_attr={"arrowsize": arrowsize},
-	)
-
-	# Add the 1st leaf
-	sub_leaf.node("%d" % outers[0],
-	              width=size,
-	              height=size,
-	              shape="circle",
-	              color=node_color,
-	              fontsize="17.0")
-
-	# Add the remaining leaves
-	for j in range(len(outers) - 1):
-		sub_leaf.node("%d" % outers[j + 1],
-		              width=size,
-		              height=size,
-		              shape="circle",
-		              color=node_color,
-		              fontsize="17.0")
-
-		# Add subgraph to leaves graph
-		leaves.subgraph(sub_leaf)
 
-		# Connect all the leaves  sequentially (with invisible edges) so that they are all plotted at the same level
-		leaves.edge("%d" % outers[j],
-		            "%d" % outers[j + 1],
-		            color="black")
-
-	# Add leaves to main graph
-	dot.subgraph(leaves)
+	# Plot all the leaves at the same level, in the new order.
+	# Connect all the leaves sequentially with invisible edges to fix the leaves order within different trees.
+	if len(outers) > 1:
+		with dot.subgraph(graph_attr={"rank": "same"},
+		                  edge_attr={"arrowsize": arrowsize, "style": "invis"}) as leaves:
+			for j in range(len(outers) - 1):
+				leaves.edge("%d" % outers[j],
+				            "%d" % outers[j + 1],
+				            color="black")
 
 
 	return dot
@@ -216,6 +112,8 @@ def visualizeTreePair(
 		figFormat ="pdf",
 		alpha_jet1 = None,
 		alpha_jet2 = None,
+		renderer = "graphviz",
+		collapse = None,
 ):
 	'''
 	Call plotBinaryTree function to create a representation of the jet tree with graphviz Digraph.
@@ -228,6 +126,9 @@ def visualizeTreePair(
 	- pySort: sort leaves in increasing py.
 	- pTSort: sort leaves in increasing pT=abs(py).
 	- label: if True, then add labels with info to each node.
+	- renderer: "graphviz" (plotBinaryTree, returns graphviz Digraphs), "svg" (svgBinaryTree, returns SVG sources) or
+	  "matplotlib" (drawBinaryTree, returns matplotlib axes). "svg" and "matplotlib" do not need the Graphviz binaries.
+	- collapse: (optional) thresholds to collapse small subtrees (see plotBinaryTree).
 
 	Note:
 	- node_id: index of the node id of each leaf  in the clustering algorithm used to get the list of leaves that were
@@ -260,31 +161,32 @@ def visualizeTreePair(
 			node_id = jetBottom["node_id"]
 
 		else:
-			jetTop = reclusterTree.recluster(in_jet1,
-			                                 alpha=int(alpha_jet2),
-			                                 save=False)
-			jetBottom = reclusterTree.recluster(in_jet1,
-			                                    alpha=int(alpha_jet1),
-			                                    save=False)
+			jetTop = reclusterCache.recluster(in_jet1,
+			                                  alpha=int(alpha_jet2))
+			jetBottom = reclusterCache.recluster(in_jet1,
+			                                     alpha=int(alpha_jet1))
 			node_id = jetTop["node_id"]
 
 
-	tree1 = plotBinaryTree(
+	if renderer == "graphviz":
+		plotTree, options = plotBinaryTree, dict(label=label, pySort=pySort, pTSort=pTSort, figFormat=figFormat, collapse=collapse)
+	elif renderer == "svg":
+		plotTree, options = svgBinaryTree, dict(label=label, pySort=pySort, pTSort=pTSort, collapse=collapse)
+	elif renderer == "matplotlib":
+		plotTree, options = drawBinaryTree, dict(label=label, pySort=pySort, pTSort=pTSort, collapse=collapse)
+	else:
+		raise ValueError(f"Unknown renderer: {renderer}")
+
+	tree1 = plotTree(
 		jetTop,
-		label = label,
 		node_id_in = node_id,
-		pySort = pySort,
-		pTSort = pTSort,
 		truthOrder = truthOrder,
-		figFormat = figFormat,
+		**options
 	)
 
-	tree2 = plotBinaryTree(
+	tree2 = plotTree(
 		jetBottom,
-		label = label,
-		pySort = pySort,
-		pTSort = pTSort,
-		figFormat= figFormat,
+		**options
 	)
 
 	return tree1, tree2
@@ -293,3 +195,367 @@ def visualizeTreePair(
 
 
 
+def treeLayout(
+		jet,
+		node_id_in = None,
+		pySort = False,
+		pTSort = False,
+		truthOrder = None,
+		collapse = None,
+):
+	'''
+	Coordinates of the nodes of a tree, with the same conventions as plotBinaryTree but without Graphviz: the leaves are
+	on one rank (at the bottom), in the order given by node_id_in, pySort or pTSort (see plotBinaryTree), and each inner
+	node is at the rank of its depth, above the mean position of the leaves below it. O(N). With collapse (see
+	plotBinaryTree), the layout is for the tree with the collapsed subtrees.
+
+	Returns:
+	 dictionary with
+	 - "jet": jet dictionary of the displayed tree (the collapsed tree from collapseTree, or the input jet)
+	 - "node_id": node ids in preorder
+	 - "parent": parent of each node (position in preorder, -1 for the root)
+	 - "is_leaf": Bool array
+	 - "x", "y": coordinates of each node, with unit distance between consecutive leaves and between ranks. The root is
+	   at y=0 and y decreases downwards.
+	 - "leaves": leaves node ids, in the plot order
+	'''
+	jet, (preorder, leaves, parent, depth, children), outers = _displayTree(jet, node_id_in, pySort, pTSort, truthOrder, collapse)
+
+	parent, depth = traversal.relabel(preorder, parent, depth)
+	is_leaf = children[:, 0] == -1
+	leaf_start, n_leaves = traversal.subtree_leaves(children)
+
+	# Position of each leaf in the plot order, for the leaves in preorder
+	position = np.zeros(len(jet["tree"]), dtype=np.float64)
+	position[np.asarray(outers, dtype=np.int64)] = np.arange(len(outers))
+	leaf_x = position[preorder[is_leaf]]
+
+	# Mean position of the leaves below each node
+	cumulative = np.concatenate(([0.], np.cumsum(leaf_x)))
+	x = (cumulative[leaf_start + n_leaves] - cumulative[leaf_start]) / n_leaves
+
+	# All the leaves at the same level
+	y = -depth.astype(np.float64)
+	y[is_leaf] = -depth.max()
+
+	return {
+		"jet": jet,
+		"node_id": preorder,
+		"parent": parent,
+		"is_leaf": is_leaf,
+		"x": x,
+		"y": y,
+		"leaves": outers,
+	}
+
+
+
+
+
+
+def drawBinaryTree(
+		jet,
+		label = False,
+		node_id_in = None,
+		pySort = False,
+		pTSort = False,
+		truthOrder = None,
+		ax = None,
+		FigName = None,
+		collapse = None,
+):
+	'''
+	Draw a tree with matplotlib, using the layout from treeLayout (no Graphviz subprocess). Same arguments as
+	plotBinaryTree.
+
+	Args:
+	- ax: matplotlib axes. If None, create a figure with a size that grows with the number of leaves and the depth.
+	- FigName: if given, save the figure.
+
+	Returns:
+	 matplotlib axes
+	'''
+	import matplotlib.pyplot as plt
+	from matplotlib.collections import LineCollection
+
+	layout = treeLayout(jet, node_id_in=node_id_in, pySort=pySort, pTSort=pTSort, truthOrder=truthOrder, collapse=collapse)
+	jet, x, y, parent, is_leaf = layout["jet"], layout["x"], layout["y"], layout["parent"], layout["is_leaf"]
+	color = [_nodeColor(jet, node_id) for node_id in layout["node_id"].tolist()]
+
+	if ax is None:
+		fig, ax = plt.subplots(figsize=(max(4., 0.6 * len(layout["leaves"])), max(3., 1.2 * (1 - y.min()))))
+
+	# Edges from each node to its parent
+	child = np.flatnonzero(parent >= 0)
+	segments = np.stack((np.stack((x[parent[child]], y[parent[child]]), axis=1),
+	                     np.stack((x[child], y[child]), axis=1)), axis=1)
+	ax.add_collection(LineCollection(segments, colors="black", linewidths=0.8, zorder=1))
+
+	# Nodes. Leaves are smaller when they are plotted at the same level (more than 1 leaf)
+	leaf_size = 500. if len(layout["leaves"]) > 1 else 1200.
+	ax.scatter(x, y, s=np.where(is_leaf, leaf_size, 1200.), c=color, zorder=2)
+
+	if label:
+		for node_id, node_x, node_y, leaf in zip(layout["node_id"].tolist(), x.tolist(), y.tolist(), is_leaf.tolist()):
+			node_label = "\n".join(row.strip() for row in _nodeLabel(jet, node_id).split("\n"))
+			ax.text(node_x, node_y, node_label.replace("&#916;", "Δ"),
+			        ha="center", va="center", fontsize=5 if leaf else 6, zorder=3)
+
+	ax.set_xlim(x.min() - 0.5, x.max() + 0.5)
+	ax.set_ylim(y.min() - 0.5, 0.5)
+	ax.set_axis_off()
+
+	if FigName:
+		ax.figure.savefig(FigName, bbox_inches="tight")
+
+	return ax
+
+
+
+
+
+
+def svgBinaryTree(
+		jet,
+		label = False,
+		node_id_in = None,
+		pySort = False,
+		pTSort = False,
+		truthOrder = None,
+		FigName = None,
+		dx = 60.,
+		dy = 90.,
+		collapse = None,
+):
+	'''
+	Write a tree as SVG, using the layout from treeLayout (no Graphviz subprocess). Same arguments as plotBinaryTree.
+
+	Args:
+	- FigName: if given, save the SVG to this file.
+	- dx, dy: distance (in px) between consecutive leaves and between ranks.
+
+	Returns:
+	 SVG source
+	'''
+	layout = treeLayout(jet, node_id_in=node_id_in, pySort=pySort, pTSort=pTSort, truthOrder=truthOrder, collapse=collapse)
+	jet, parent, is_leaf = layout["jet"], layout["parent"], layout["is_leaf"]
+
+	# Nodes size. Leaves are smaller when they are plotted at the same level (more than 1 leaf)
+	radius = np.where(is_leaf & (len(layout["leaves"]) > 1), 0.32 * dx, 0.5 * dx)
+	margin = 0.5 * dx + 2
+	x = layout["x"] * dx + margin
+	y = -layout["y"] * dy + margin
+	width, height = x.max() + margin, y.max() + margin
+
+	child = np.flatnonzero(parent >= 0)
+	lines = [
+		f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}"/>'
+		for x1, y1, x2, y2 in zip(x[parent[child]].tolist(), y[parent[child]].tolist(), x[child].tolist(), y[child].tolist())
+	]
+
+	circles = [
+		f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{r:.1f}" fill="{_nodeColor(jet, node_id)}"/>'
+		for cx, cy, r, node_id in zip(x.tolist(), y.tolist(), radius.tolist(), layout["node_id"].tolist())
+	]
+
+	texts = []
+	if label:
+		for node_id, cx, cy, r in zip(layout["node_id"].tolist(), x.tolist(), y.tolist(), radius.tolist()):
+			rows = [row.strip() for row in _nodeLabel(jet, node_id).split("\n")]
+			fontsize = 0.28 * r
+			top = cy - 0.5 * fontsize * (len(rows) - 2)
+			tspans = "".join(f'<tspan x="{cx:.1f}" y="{top + k * fontsize:.1f}">{row}</tspan>' for k, row in enumerate(rows))
+			texts.append(f'<text font-size="{fontsize:.1f}">{tspans}</text>')
+
+	svg = "\n".join([
+		f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" viewBox="0 0 {width:.1f} {height:.1f}">',
+		'<g stroke="black" stroke-width="1">', *lines, '</g>',
+		'<g>', *circles, '</g>',
+		'<g font-family="Times,serif" text-anchor="middle">', *texts, '</g>',
+		'</svg>',
+	])
+
+	if FigName:
+		with open(FigName, "w") as f:
+			f.write(svg)
+
+	return svg
+
+
+
+
+
+
+def collapseTree(jet, min_leaves=None, max_depth=None, min_delta=None):
+	'''
+	Level of detail tree: each inner node below a threshold (and not below another collapsed node) becomes a single
+	summary leaf, with the total momentum and the number of the leaves of its subtree. The summaries are computed for all
+	the nodes at once, with cumulative sums over the leaves in preorder (the leaves below a node are consecutive).
+
+	Args:
+	- jet: jet dictionary
+	- min_leaves: collapse the subtrees with fewer leaves.
+	- max_depth: collapse the subtrees with root at this depth (or deeper).
+	- min_delta: collapse the subtrees with root Delta (jet["deltas"]) smaller than this value. Ignored if the jet
+	  has no deltas.
+
+	Returns:
+	 jet dictionary of the collapsed tree, with the nodes labeled by their position in preorder (root_id=0) and
+	 - "collapsed": Bool. True for the summary nodes.
+	 - "n_leaves": number of leaves of the input tree below each node.
+	 - "node_ids": node id of each node in the input jet.
+	 - "leaf_start": index of the first leaf below each node, in the list of leaves of the input tree in preorder.
+	'''
+	preorder, leaves, parent, depth, children = traversal.traverse_jet(jet)
+	parent, depth = traversal.relabel(preorder, parent, depth)
+	is_leaf = children[:, 0] == -1
+	leaf_start, n_leaves = traversal.subtree_leaves(children)
+	M = len(preorder)
+
+	collapse = np.zeros(M, dtype=bool)
+	if min_leaves is not None:
+		collapse |= n_leaves < min_leaves
+	if max_depth is not None:
+		collapse |= depth >= max_depth
+	if min_delta is not None and "deltas" in jet.keys():
+		collapse |= np.asarray(jet["deltas"])[preorder] < min_delta
+	collapse &= ~is_leaf
+
+	# Hide the nodes below a collapsed node. The subtree of a node is [node, node + 2 * n_leaves - 1) in preorder
+	nodes = np.flatnonzero(collapse)
+	marks = np.zeros(M + 1, dtype=np.int64)
+	np.add.at(marks, nodes + 1, 1)
+	np.add.at(marks, nodes + 2 * n_leaves[nodes] - 1, -1)
+	shown = np.flatnonzero(np.cumsum(marks[:M]) == 0)
+
+	# Total momentum of the leaves below each shown node
+	content = np.asarray(jet["content"])[preorder]
+	cumulative = np.concatenate((np.zeros((1,) + content.shape[1:]), np.cumsum(content[is_leaf], axis=0, dtype=np.float64)))
+	start, end = leaf_start[shown], leaf_start[shown] + n_leaves[shown]
+
+	position = np.full(M + 1, -1, dtype=np.int64)
+	position[shown] = np.arange(len(shown))
+	tree = position[children[shown]]
+	tree[collapse[shown]] = -1
+
+	collapsed_jet = {
+		"tree": tree,
+		"content": np.where(collapse[shown, None], cumulative[end] - cumulative[start], content[shown]),
+		"root_id": 0,
+		"algorithm": jet.get("algorithm"),
+		"collapsed": collapse[shown],
+		"n_leaves": n_leaves[shown],
+		"node_ids": preorder[shown],
+		"leaf_start": start,
+	}
+	if "deltas" in jet.keys():
+		collapsed_jet["deltas"] = np.asarray(jet["deltas"])[preorder[shown]]
+
+	logger.debug(f"Collapsed tree: {len(shown)} of {M} nodes")
+
+	return collapsed_jet
+
+
+
+
+
+
+def _displayTree(jet, node_id_in=None, pySort=False, pTSort=False, truthOrder=None, collapse=None):
+	'''
+	Tree to display, its traversal and the leaves in the plot order (see plotBinaryTree). With collapse, the leaves of
+	the collapsed tree are ordered by the first position of the leaves below them in the plot order of the input tree.
+	'''
+	traversed = traversal.traverse_jet(jet)
+	outers = _leafOrder(jet, traversed[1].tolist(), node_id_in, pySort, pTSort, truthOrder)
+
+	if not collapse:
+		return jet, traversed, outers
+
+	collapsed_jet = collapseTree(jet, **collapse)
+
+	# Plot order of the leaves of the input tree, for the leaves in preorder
+	rank = np.zeros(len(jet["tree"]), dtype=np.int64)
+	rank[np.asarray(outers, dtype=np.int64)] = np.arange(len(outers))
+	rank = rank[traversed[1]]
+
+	traversed = traversal.traverse(collapsed_jet["tree"], collapsed_jet["root_id"])
+	leaves = traversed[1]
+	first = np.minimum.reduceat(rank, collapsed_jet["leaf_start"][leaves])
+
+	return collapsed_jet, traversed, leaves[np.argsort(first, kind="stable")].tolist()
+
+
+
+
+
+
+def _nodeColor(jet, node_id):
+	if jet.get("collapsed") is not None and jet["collapsed"][node_id]:
+		return "lightgrey"
+
+	return "wheat" if jet["tree"][node_id][0] != -1 else "lightblue"
+
+
+
+
+
+
+def _leafOrder(jet, outers, node_id_in=None, pySort=False, pTSort=False, truthOrder=None):
+	'''
+	Leaves node ids in the plot order (see plotBinaryTree), from the leaves in the order in which they are accessed when
+	traversing the tree.
+	'''
+	# Sort the leaves to match the order in which they are accessed when traverseing a tree from some other clustering algorithm (or truth jet).
+	# The order is in node_id_in.
+	if node_id_in is not None and len(node_id_in) > 0:
+		if not truthOrder and jet["algorithm"] == "truth":
+			outers = [outers[k] for k in node_id_in]
+		else:
+			new_idx_list = list(zip(outers, node_id_in))
+			logger.debug(f"new_idx_list before sorting=  {new_idx_list}")
+			new_idx_list = sorted(new_idx_list,
+			                      key=lambda x: x[1])  # Sort according to node_id_in.
+			logger.debug(f"new_idx_list after sorting=  {new_idx_list}")
+			outers = [x for (x, y) in new_idx_list]  # List the node ids in the new order.
+
+
+	# Sort the leaves in increasing py. (Also commnent/uncomment ptList line below to use absolute value)
+	if pySort:
+		ptList = [jet["content"][node_id][0] for node_id in outers]
+	elif pTSort:
+		ptList=[np.absolute(jet["content"][node_id][0]) for node_id in outers]
+
+	if pySort or pTSort:
+		new_idx_list = list(zip(outers, ptList))
+		logger.debug(f"new_idx_list before sorting=  {new_idx_list}")
+		new_idx_list = sorted(new_idx_list,
+		                      key=lambda x: x[1])
+		logger.debug(f"new_idx_list after sorting=  {new_idx_list}")
+
+		outers = [x for (x, y) in new_idx_list]  # List the node ids in the new order.
+		logger.debug(f"outers after= {outers}")
+
+	return outers
+
+
+
+
+
+
+def _nodeLabel(jet, node_id):
+	'''
+	Label of a node: (py,pz) and Delta (for the inner nodes of the truth jet). Collapsed subtrees (see collapseTree) also
+	show their number of leaves.
+	'''
+	if jet.get("collapsed") is not None and jet["collapsed"][node_id]:
+		return "n:%d\n py:%0.1f\n pz:%0.1f" % (jet["n_leaves"][node_id],
+		                                      jet["content"][node_id][0],
+		                                      jet["content"][node_id][1])
+
+	if "deltas" in jet.keys() and jet["deltas"][node_id] >= 0.:
+		return "py:%0.1f\n pz:%0.1f\n &#916;:%0.2f " % (jet["content"][node_id][0],
+		                                              jet["content"][node_id][1],
+		                                              jet["deltas"][node_id])
+
+	return "py:%0.1f\n pz:%0.1f" % (jet["content"][node_id][0],
+	                                jet["content"][node_id][1])
@@ -0,0 +1,133 @@
+import os
+import copy
+import logging
+import matplotlib
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts.reclusterTree import algorithm_names
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+
+
+
+
+def render_batch(
+		jets,
+		out_dir,
+		alphas = (1, 0, -1),
+		figFormat = "png",
+		full_path = False,
+		n_jobs = None,
+		renderer = "matplotlib",
+):
+	"""
+	Render the heat clustermaps of a list of truth jets without showing them (e.g. for reports). For each jet we save:
+	- {name}_truth: truth jet heat clustermap
+	- {name}_{algorithm}: heat clustermap of the jet reclustered with each algorithm (kt, CA, antikt)
+	- {name}_diff_truth_{algorithm}: difference between the truth jet and the reclustered jet heat data
+
+	The worker processes use the non-interactive Agg backend (with n_jobs=1 the backend of the calling process is kept,
+	with interactive mode off), every figure is closed after saving it, and the jets are split over a process pool, so
+	memory stays flat for any number of jets.
+
+	Args:
+	:param jets: list (or iterable) of truth jet dictionaries.
+	:param out_dir: dir for the figures.
+	:param alphas: values of alpha to recluster each jet. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
+	:param figFormat: figure format, e.g. png or pdf.
+	:param full_path: Bool. Heat data definition (see heatClustermap.heat_dendrogram).
+	:param n_jobs: number of worker processes. If None, use all the cores. If 1, run in the current process.
+	:param renderer: "matplotlib" or "seaborn" (see heatClustermap.heat_dendrogram).
+
+	Returns:
+	 list with one entry for each input jet, in the same order. Each entry is the list of saved figures, or the exception
+	 raised when rendering that jet (a failure does not stop the other jets).
+	"""
+
+	os.makedirs(out_dir, exist_ok=True)
+
+	tasks = [(i, jet, out_dir, tuple(alphas), figFormat, full_path, renderer) for i, jet in enumerate(jets)]
+	n_jobs = n_jobs or os.cpu_count() or 1
+
+	if n_jobs == 1 or len(tasks) <= 1:
+		# Keep the backend of the calling process (e.g. the inline plots of a notebook). The figures are closed after
+		# saving them, and interactive mode is off so they are never shown.
+		import matplotlib.pyplot as plt
+		with plt.ioff():
+			results = list(map(_renderWorker, tasks))
+
+	else:
+		with ProcessPoolExecutor(max_workers=n_jobs, initializer=_initWorker) as executor:
+			results = list(executor.map(_renderWorker, tasks, chunksize=max(1, len(tasks) // (4 * n_jobs))))
+
+	for i, result in enumerate(results):
+		if isinstance(result, Exception):
+			logger.warning(f"Rendering failed for jet {i}: {result!r}")
+
+	return results
+
+
+
+
+
+
+def _initWorker():
+	"""
+	Use the non-interactive Agg backend in the worker processes, so that figures are never shown
+	"""
+	matplotlib.use("Agg", force=True)
+
+
+
+
+
+
+def _renderWorker(task):
+	"""
+	Render the figures of one jet for render_batch. Exceptions are returned instead of raised.
+	"""
+	i, truth_jet, out_dir, alphas, figFormat, full_path, renderer = task
+
+	# Imported here, after the backend is set
+	import matplotlib.pyplot as plt
+	from scripts import heatClustermap
+	from scripts import reclusterTree
+
+	name = str(truth_jet.get("name", i))
+	figures = []
+
+	def _figName(label):
+		figures.append(os.path.join(out_dir, f"{name}_{label}.{figFormat}"))
+		return figures[-1]
+
+	options = dict(full_path=full_path, renderer=renderer, show=False)
+
+	# Figures left open when rendering fails are closed at the end, so they do not pile up in long-lived workers (only
+	# the new ones, as with n_jobs=1 this runs in the calling process)
+	open_figures = set(plt.get_fignums())
+
+	try:
+		heatClustermap.heat_dendrogram(truthJet=copy.deepcopy(truth_jet), FigName=_figName("truth"), **options)
+
+		reclustered = reclusterTree.recluster_multi(truth_jet, alphas=alphas, save=False)
+
+		for alpha in alphas:
+			algorithm = algorithm_names.get(alpha, f"alpha_{alpha}")
+
+			heatClustermap.heat_dendrogram(recluster_jet1=reclustered[alpha], FigName=_figName(algorithm), **options)
+
+			heatClustermap.dendrogramDiff(truthJet=copy.deepcopy(truth_jet),
+			                              recluster_jet1=reclustered[alpha],
+			                              FigName=_figName(f"diff_truth_{algorithm}"),
+			                              **options)
+
+		return figures
+
+	except Exception as error:
+		return error
+
+	finally:
+		for number in set(plt.get_fignums()) - open_figures:
+			plt.close(number)
@@ -1,22 +1,219 @@
-import seaborn as sns
 import numpy as np
 import matplotlib.pyplot as plt
 import logging
 
+from scripts import heatLOD
+from scripts import heatRender
 from scripts import linkageList
-from scripts import reclusterTree
-from scripts.utils import get_logger
+from scripts import traversal
+from scripts import reclusterCache
+from scripts.utils import get_logger, get_diagnostics
 
 logger = get_logger(level=logging.INFO)
 
 
 
+class CondensedHeat(object):
+	"""
+	Symmetric heat data matrix with zero diagonal, stored in condensed form: the upper triangle by rows
+	(as in scipy.spatial.distance.squareform), with length N(N-1)/2 and a small integer dtype. Compared to the dense
+	float64 matrix, uint8 data takes 16 times less memory.
+
+	Reordering the rows and columns (e.g. following the truth jet order, see treeMetrics.truth_order) is lazy: it only composes the
+	permutation in order, and the data is shared. Differences are computed by rows in the smallest signed dtype that
+	fits them. Use toarray() to get the dense matrix (e.g. for the plots).
+
+	Args:
+	- data: condensed heat data
+	- N: number of leaves
+	- order: (optional) permutation of the leaves, so that entry [a,b] is the entry [order[a],order[b]] of the data.
+	"""
+
+	def __init__(self, data, N, order=None):
+		self.data = data
+		self.N = N
+		self.order = order
+
+	@property
+	def shape(self):
+		return (self.N, self.N)
+
+	@property
+	def nbytes(self):
+		return self.data.nbytes + (self.order.nbytes if self.order is not None else 0)
+
+	def reorder(self, order):
+		"""
+		Lazy version of heat_data[order, :][:, order]
+		"""
+		order = np.asarray(order) if self.order is None else self.order[np.asarray(order)]
+
+		return CondensedHeat(self.data, self.N, order=order)
+
+	def __getitem__(self, pair):
+		"""
+		Entries for the leaves (i, j), with i and j ints or arrays of ints
+		"""
+		i, j = np.asarray(pair[0]), np.asarray(pair[1])
+		if self.order is not None:
+			i, j = self.order[i], self.order[j]
+
+		low, high = np.minimum(i, j), np.maximum(i, j)
+		k = self.N * low - low * (low + 1) // 2 + (high - low - 1)
+
+		return np.where(low == high, 0, self.data[np.where(low == high, 0, k)])
+
+	def row(self, i):
+		"""
+		Entries [i, i+1:] of the (reordered) matrix
+		"""
+		return self[i, np.arange(i + 1, self.N)]
+
+	def condensed(self):
+		"""
+		Condensed data following the current order
+		"""
+		if self.order is None:
+			return self.data
+
+		return np.concatenate([self.row(i) for i in range(self.N - 1)] + [self.data[:0]])
+
+	def __sub__(self, other):
+		"""
+		Signed difference, with the smallest signed dtype that fits it
+		"""
+		dtype = min_int_dtype(max(int(self.data.max(initial=0)), int(other.data.max(initial=0))))
+		data = np.zeros(len(self.data), dtype=dtype)
+
+		start = 0
+		for i in range(self.N - 1):
+			end = start + self.N - i - 1
+			data[start:end] = self.row(i).astype(dtype) - other.row(i).astype(dtype)
+			start = end
+
+		return CondensedHeat(data, self.N)
+
+	def toarray(self, dtype=np.float64):
+		"""
+		Dense N x N matrix
+		"""
+		heat_data = np.zeros((self.N, self.N), dtype=dtype)
+		upper = np.triu_indices(self.N, k=1)
+		heat_data[upper] = self.condensed()
+		heat_data.T[upper] = heat_data[upper]
+
+		return heat_data
+
+	def __repr__(self):
+		return "CondensedHeat(N=%d, dtype=%s, reordered=%s)" % (self.N, self.data.dtype, self.order is not None)
+
+
+
+
+
+
+def min_int_dtype(max_value):
+	"""
+	Smallest signed integer dtype that can hold the differences between values in [0, max_value]
+	"""
+	for dtype in (np.int8, np.int16, np.int32):
+		if max_value <= np.iinfo(dtype).max:
+			return dtype
+
+	return np.int64
+
+
+
+
+
+
+def _clustermap(renderer, data, **kwargs):
+	"""
+	Draw a heat clustermap with heatRender.clustermap or seaborn.clustermap. Seaborn is only imported when it is used.
+	"""
+	if renderer == "seaborn":
+		import seaborn as sns
+		return sns.clustermap(data, **kwargs)
+
+	elif renderer == "matplotlib":
+		return heatRender.clustermap(data, **kwargs)
+
+	raise ValueError(f"Unknown renderer: {renderer}")
+
+
+
+
+
+
+def _finishFigure(grid, FigName=None, show=True):
+	"""
+	Save the figure of a clustermap if FigName is given, and show it or close it. Without show, the figure is closed
+	even if saving fails, so that it is not kept by pyplot (a closed figure can still be saved with fig.savefig).
+	"""
+	fig = grid if isinstance(grid, plt.Figure) else grid.fig
+
+	try:
+		if FigName:
+			fig.savefig(str(FigName))
+
+		if show:
+			plt.show()
+
+	finally:
+		if not show:
+			plt.close(fig)
+
+	return fig
+
+
+
+
+
+
+def getHeatData(jet, condensed=False):
+	"""
+	Heat data matrices for all the pairs of leaves of a jet, with the leaves in the order in which they are accessed when
+	traversing the tree (the order of jet["tree_ancestors"]). Given a pair of leaves {i,j}, the number of steps for each
+	leaf to reach their lowest common ancestor (LCA) is {Si,Sj}. The LCA depths are given by traversal.LCAIndex.
+
+	Args:
+	- jet: jet dictionary
+	- condensed: if True, return the heat data as CondensedHeat objects instead of dense float64 matrices.
+
+	Returns:
+	- full_path_data: total number of steps to connect each pair of leaves, Si+Sj.
+	- max_steps_data: max number of steps, max{Si,Sj}.
+	"""
+
+	lca_index = traversal.LCAIndex.from_jet(jet)
+
+	if condensed:
+		N = len(lca_index.leaves)
+		full_path_data, max_steps_data = lca_index.condensed_heat_data()
+		full_path_data, max_steps_data = CondensedHeat(full_path_data, N), CondensedHeat(max_steps_data, N)
+
+	else:
+		full_path_data, max_steps_data = lca_index.heat_data()
+
+	trace = get_diagnostics()
+	if trace is not None:
+		trace.record("heat_data", N=len(lca_index.leaves), condensed=condensed)
+
+	return full_path_data, max_steps_data
+
+
+
+
+
+
 def heat_dendrogram(
 		truthJet = None,
 		recluster_jet1 = None,
 		recluster_jet2 = None,
 		full_path = False,
 		FigName = None,
+		renderer = "matplotlib",
+		show = True,
 ):
 	"""
 	Create  a heat dendrogram clustermap.
@@ -27,73 +224,37 @@ def heat_dendrogram(
 	:param recluster_jet2: reclustered jet 2
 	:param full_path: Bool. If True, then use the total number of steps to connect a pair of leaves as the heat data. If False, then Given a pair of jet constituents {i,j} and the number of steps needed for each constituent to reach their closest common ancestor {Si,Sj}, the heat map scale represents the maximum number of steps, i.e. max{Si,Sj}.
 	:param FigName: Dir and location to save a plot.
+	:param renderer: "matplotlib" to draw the heat map with heatRender.clustermap (a single imshow and the precomputed dendrograms), or "seaborn" to use seaborn.clustermap.
+	:param show: Bool. If True, show the figure with plt.show(). If False, the figure is not shown, and it is closed (after saving it when FigName is given), e.g. for batch rendering, see heatBatch.
+
+	Returns: the matplotlib figure
 	"""
 
+	# Debug strings (e.g. whole linkage lists) are only formatted at the DEBUG level
+	debug = logger.isEnabledFor(logging.DEBUG)
+
 	# Build truth jet heat data
 	if truthJet:
 
 		# Calculate linkage list and add it to the truth jet dict
 		linkageList.draw_truth(truthJet)
 
-		ancestors = truthJet["tree_ancestors"]
+		heat_jet = truthJet
 
 
 	# Build jet 1 heat data
 	else:
 		# Recluster jet using itself as an input. This way, we use the constituents (leaves) as ordered in this jet and the tree_ancestors list for this algorithm. (Their leaves idx goes from 0 to N leaves in order when using jet 1 both as rows and colums)
-		reclustjet = reclusterTree.recluster(recluster_jet1,
-		                                     alpha=int(recluster_jet1["algorithm"]),
-		                                     save=False)
-
-		ancestors = reclustjet["tree_ancestors"]
-
-
-	# Number of nodes from root to leaf for each leaf
-	level_length = [len(entry) for entry in ancestors]
-	max_level = np.max(level_length)
+		reclustjet = reclusterCache.recluster(recluster_jet1,
+		                                      alpha=int(recluster_jet1["algorithm"]))
 
-	# Pad tree_ancestors list for dim1=max_level, adding a different negative number at each row (for each leaf)
-	ancestors1_array = np.asarray([np.concatenate(
-		(ancestors[i], -(i + 1) * np.ones((max_level - len(ancestors[i]))))
-	) for i in range(len(ancestors))])
+		heat_jet = reclustjet
 
 
-	N_heat = len(ancestors1_array) # Number of constituents
-	heat_data = np.zeros((N_heat, N_heat))
-	neg_entries = np.sum(np.array(ancestors1_array) < 0, axis=1)
-
 	#######################
-	# Get total number of steps to connect a pair of leaves as the heat data
-	if full_path:
-		for i in range(N_heat):
-			for j in range(i + 1, N_heat):
-
-				logger.debug(f"Number of steps between nodes =  {np.count_nonzero(ancestors1_array[i]-ancestors1_array[j]==0)}")
-
-				# Sum of number of nodes  from root to leaf for each leaf - 2 * number of nodes that are common ancestors
-				heat_data[i, j] = (2 * max_level - (neg_entries[i] + neg_entries[j])) \
-				                  - 2 * np.count_nonzero((ancestors1_array[i] - ancestors1_array[j]) == 0)
-
-				heat_data[j, i] = heat_data[i, j]
-
-				logger.debug(f"heat data = {heat_data[i, j]}")
-
-
-	# Given a pair of jet constituents {i,j} and the number of steps needed for each constituent to reach their closest common ancestor
-	# {Si,Sj}, the heat map scale represents the maximum number of steps, i.e. max{Si,Sj}.
-	else:
-		for i in range(N_heat):
-			for j in range(i + 1, N_heat):
-
-				logger.debug(f"Number of steps between nodes =  {np.count_nonzero(ancestors1_array[i]-ancestors1_array[j]==0)}")
-
-				# Number of nodes for the longest path from root to leaf (between the 2 leaves) - Number of nodes that are common ancestors
-				heat_data[i, j] = (max_level - np.minimum(neg_entries[i], neg_entries[j])) \
-				                  - np.count_nonzero((ancestors1_array[i] - ancestors1_array[j]) == 0)
-
-				heat_data[j, i] = heat_data[i, j]
-
-				logger.debug(f"heat data = {heat_data[i, j]}")
+	# Get the heat data (total number of steps to connect a pair of leaves if full_path, or max{Si,Sj} otherwise)
+	full_path_data, max_steps_data = getHeatData(heat_jet)
+	heat_data = full_path_data if full_path else max_steps_data
 
 	#######################
 	# Build heat clustermap
@@ -103,7 +264,8 @@ def heat_dendrogram(
 
 			logger.info(f"truth heat data ----  alpha row: truth -- alpha column: truth")
 
-			sns.clustermap(
+			grid = _clustermap(
+				renderer,
 				heat_data,
 				row_cluster=True,
 				col_cluster=True,
@@ -111,16 +273,14 @@ def heat_dendrogram(
 				col_linkage=truthJet["linkage_list"],
 			)
 
-			if FigName:
-				plt.savefig(str(FigName))
-
-			plt.show()
+			return _finishFigure(grid, FigName, show)
 
 		if recluster_jet1:
 
 			logger.info(f"alpha row: {recluster_jet1['algorithm']} -- alpha column: truth")
 
-			sns.clustermap(
+			grid = _clustermap(
+				renderer,
 				heat_data,
 				row_cluster=True,
 				col_cluster=True,
@@ -128,37 +288,34 @@ def heat_dendrogram(
 				col_linkage=truthJet["linkage_list"],
 			)
 
-			if FigName:
-				plt.savefig(str(FigName))
-
-			plt.show()
+			return _finishFigure(grid, FigName, show)
 
 
 	else: # jet 1 heat data
 
 		if not recluster_jet2:
-			logger.debug(f"reclustjet['linkage_list']= {reclustjet['linkage_list']}")
+			if debug:
+				logger.debug(f"reclustjet['linkage_list']= {reclustjet['linkage_list']}")
 			logger.info(f"alpha row: {reclustjet['algorithm']} -- alpha column: {reclustjet['algorithm']}")
 
-			sns.clustermap(
+			grid = _clustermap(
+				renderer,
 				heat_data,
 				row_cluster=True,
 				col_cluster=True,
 				row_linkage=reclustjet["linkage_list"],
 				col_linkage=reclustjet["linkage_list"],
 			)
-			if FigName:
-				plt.savefig(str(FigName))
-
-			plt.show()
+			return _finishFigure(grid, FigName, show)
 
 		if recluster_jet2:
 
-			reclustjet2 = reclusterTree.recluster(recluster_jet1, alpha=int(recluster_jet2["algorithm"]), save=False)
+			reclustjet2 = reclusterCache.recluster(recluster_jet1, alpha=int(recluster_jet2["algorithm"]))
 
 			logger.info(f"alpha row: {reclustjet2['algorithm']} -- alpha column: {reclustjet['algorithm']}")
 
-			sns.clustermap(
+			grid = _clustermap(
+				renderer,
 				heat_data,
 				row_cluster=True,
 				col_cluster=True,
@@ -166,93 +323,111 @@ def heat_dendrogram(
 				col_linkage=reclustjet["linkage_list"],
 				)
 
-			if FigName:
-				plt.savefig(str(FigName))
-
-			plt.show()
+			return _finishFigure(grid, FigName, show)
 
 
 
 
 
 
-def dendrogramDiff(
-		truthJet = None,
-		recluster_jet1 = None,
-		recluster_jet2 = None,
+def heat_dendrogram_lod(
+		jet,
+		depth = None,
+		n_clusters = 256,
 		full_path = False,
+		statistic = "mean",
+		lod = None,
 		FigName = None,
+		renderer = "matplotlib",
+		show = True,
 ):
 	"""
-	Create  a heat dendrogram displaying the difference between the clustermap.
+	Level of detail heat clustermap for large jets. The tree is cut at a depth or into n_clusters subtrees, and each
+	block of the heat map is the mean (or max) of the heat data of the pairs of leaves of 2 subtrees, computed from
+	subtree statistics (see heatLOD.TreeLOD). The cost depends on the number of clusters instead of N^2.
 
 	Args:
-	:param truthJet: Truth jet dictionary
-	:param recluster_jet1: reclustered jet 1
-	:param recluster_jet2: reclustered jet 2
-	:param full_path: Bool. If True, then use the total number of steps to connect a pair of leaves as the heat data. If False, then Given a pair of jet constituents {i,j} and the number of steps needed for each constituent to reach their closest common ancestor {Si,Sj}, the heat map scale represents the maximum number of steps, i.e. max{Si,Sj}.
+	:param jet: jet dictionary (truth or reclustered jet)
+	:param depth: cut the tree at this depth. If None, use n_clusters.
+	:param n_clusters: number of clusters (rows and columns of the heat map).
+	:param full_path: Bool. Heat data definition (see heat_dendrogram).
+	:param statistic: "mean" or "max" of the heat data in each block.
+	:param lod: (optional) heatLOD.TreeLOD of the jet, to reuse it. Full resolution tiles of a subtree are given by lod.tile(node).
 	:param FigName: Dir and location to save a plot.
-	"""
+	:param renderer: "matplotlib" or "seaborn" (see heat_dendrogram).
+	:param show: Bool. If True, show the figure with plt.show() (see heat_dendrogram).
 
-	#############################
-	def getHeatMap(in_ancestors):
-		# Number of nodes from root to leaf for each leaf
-		level_length = [len(entry) for entry in in_ancestors]
-		max_level = np.max(level_length)
+	Returns: the matplotlib figure
+	"""
 
-		# Pad tree_ancestors list for dim1=max_level, adding a different negative number at each row (for each leaf)
-		ancestors1_array = np.asarray([np.concatenate(
-			(in_ancestors[i], -(i + 1) * np.ones((max_level - len(in_ancestors[i]))))
-		) for i in range(len(in_ancestors))])
+	lod = lod or heatLOD.TreeLOD(jet)
+	roots = lod.cut(depth=depth, n_clusters=None if depth is not None else n_clusters)
 
-		N_heat = len(ancestors1_array) # Number of constituents
-		heat_data = np.zeros((N_heat, N_heat))
-		neg_entries = np.sum(np.array(ancestors1_array) < 0, axis=1)
+	heat_data = lod.block_heat(roots, full_path=full_path, statistic=statistic)
+	linkage_list = lod.linkage(roots)
 
+	logger.info(f"LOD heat data ---- {len(roots)} clusters for {lod.N} leaves")
 
-		# Get total number of steps to connect a pair of leaves, as the heat data matrix
-		if full_path:
-			for i in range(N_heat):
-				for j in range(i + 1, N_heat):
+	grid = _clustermap(
+		renderer,
+		heat_data,
+		row_cluster=len(roots) > 1,
+		col_cluster=len(roots) > 1,
+		row_linkage=linkage_list,
+		col_linkage=linkage_list,
+	)
 
-					logger.debug(f"Number of steps between nodes =  {np.count_nonzero(ancestors1_array[i]-ancestors1_array[j]==0)}")
+	return _finishFigure(grid, FigName, show)
 
-					# Sum of number of nodes  from root to leaf for each leaf - 2 * number of nodes that are common ancestors
-					heat_data[i, j] = (2 * max_level - (neg_entries[i] + neg_entries[j])) \
-					                  - 2 * np.count_nonzero((ancestors1_array[i] - ancestors1_array[j]) == 0)
 
-					heat_data[j, i] = heat_data[i, j]
 
-					logger.debug(f"heat data = {heat_data[i, j]}")
 
 
-		# Given a pair of jet constituents {i,j} and the number of steps needed for each constituent to reach their closest common ancestor
-		# {Si,Sj}, the heat map scale represents the maximum number of steps, i.e. max{Si,Sj}.
-		else:
-			for i in range(N_heat):
-				for j in range(i + 1, N_heat):
 
-					logger.debug(f"Number of steps between nodes =  {np.count_nonzero(ancestors1_array[i]-ancestors1_array[j]==0)}")
+def dendrogramDiff(
+		truthJet = None,
+		recluster_jet1 = None,
+		recluster_jet2 = None,
+		full_path = False,
+		FigName = None,
+		renderer = "matplotlib",
+		show = True,
+):
+	"""
+	Create  a heat dendrogram displaying the difference between the clustermap.
 
-					# Number of nodes for the longest path from root to leaf (between the 2 leaves) - Number of nodes that are common ancestors
-					heat_data[i, j] = (max_level - np.minimum(neg_entries[i], neg_entries[j])) \
-					                  - np.count_nonzero((ancestors1_array[i] - ancestors1_array[j]) == 0)
+	Args:
+	:param truthJet: Truth jet dictionary
+	:param recluster_jet1: reclustered jet 1
+	:param recluster_jet2: reclustered jet 2
+	:param full_path: Bool. If True, then use the total number of steps to connect a pair of leaves as the heat data. If False, then Given a pair of jet constituents {i,j} and the number of steps needed for each constituent to reach their closest common ancestor {Si,Sj}, the heat map scale represents the maximum number of steps, i.e. max{Si,Sj}.
+	:param FigName: Dir and location to save a plot.
+	:param renderer: "matplotlib" to draw the heat map with heatRender.clustermap (a single imshow and the precomputed dendrograms), or "seaborn" to use seaborn.clustermap.
+	:param show: Bool. If True, show the figure with plt.show(). If False, the figure is not shown, and it is closed (after saving it when FigName is given), e.g. for batch rendering, see heatBatch.
 
-					heat_data[j, i] = heat_data[i, j]
+	Returns: the matplotlib figure
+	"""
 
-					logger.debug(f"heat data = {heat_data[i, j]}")
+	#############################
+	def getHeatMap(in_jet):
+		full_path_data, max_steps_data = getHeatData(in_jet, condensed=True)
 
-		return heat_data
+		return full_path_data if full_path else max_steps_data
 
 	#############################
-	heat_data_jet1 = getHeatMap(recluster_jet1["tree_ancestors"])
-	logger.debug(f"Jet 1 Heat_data = {heat_data_jet1}")
+	# Debug strings (heat data matrices) are only formatted at the DEBUG level
+	debug = logger.isEnabledFor(logging.DEBUG)
 
-	new_heat_data_jet1 = heat_data_jet1[recluster_jet1["node_id"], :]
-	logger.debug(f"Jet 1 Heat data after reordering the rows following the truth jet order {new_heat_data_jet1}")
+	heat_data_jet1 = getHeatMap(recluster_jet1)
+	if debug:
+		logger.debug(f"Jet 1 Heat_data = {heat_data_jet1}")
 
-	new_heat_data_jet1 = new_heat_data_jet1[:, recluster_jet1["node_id"]]
-	logger.debug(f"Jet 1 Heat data after reordering the rows and columns following the truth jet order {new_heat_data_jet1}")
+	# Reorder the rows and columns following the truth jet order (lazy, the condensed data is shared). Leaf k of a
+	# reclustered jet is the truth leaf node_id[k], so the permutation is argsort(node_id) (see treeMetrics.truth_order)
+	from scripts import treeMetrics
+	new_heat_data_jet1 = heat_data_jet1.reorder(treeMetrics.truth_order(recluster_jet1))
+	if debug:
+		logger.debug(f"Jet 1 Heat data after reordering the rows and columns following the truth jet order {new_heat_data_jet1}")
 
 
 	if truthJet:
@@ -260,21 +435,20 @@ def dendrogramDiff(
 		# Calculate linkage list tree_ancestors list, and add them to the truth jet dict
 		linkageList.draw_truth(truthJet)
 
-		heat_data_truth= getHeatMap(truthJet["tree_ancestors"])
-		logger.debug(f"Truth jet Heat_data = {heat_data_truth}")
+		heat_data_truth= getHeatMap(truthJet)
+		if debug:
+			logger.debug(f"Truth jet Heat_data = {heat_data_truth}")
 
 		dataDiff = heat_data_truth - new_heat_data_jet1
 		logger.info(f"(Truth jet - recluster jet1) heat data")
 
 	elif recluster_jet2:
 
-		heat_data_jet2 = getHeatMap(recluster_jet2["tree_ancestors"])
-
-		new_heat_data_jet2 = heat_data_jet2[recluster_jet2["node_id"], :]
-		logger.debug(f"Jet 2 Heat data after reordering the rows following the truth jet order {new_heat_data_jet2}")
+		heat_data_jet2 = getHeatMap(recluster_jet2)
 
-		new_heat_data_jet2 = new_heat_data_jet2[:, recluster_jet2["node_id"]]
-		logger.debug(f"Jet 2 Heat data after reordering the rows and columns following the truth jet order {new_heat_data_jet2}")
+		new_heat_data_jet2 = heat_data_jet2.reorder(treeMetrics.truth_order(recluster_jet2))
+		if debug:
+			logger.debug(f"Jet 2 Heat data after reordering the rows and columns following the truth jet order {new_heat_data_jet2}")
 
 		dataDiff = new_heat_data_jet2 - new_heat_data_jet1
 
@@ -282,17 +456,15 @@ def dendrogramDiff(
 
 
 	# Plot heat dendrogram differences
-	sns.clustermap(
-		dataDiff,
+	grid = _clustermap(
+		renderer,
+		dataDiff.toarray(),
 		row_cluster=False,
 		col_cluster=False,
 	)
 
 
-	if FigName:
-		plt.savefig(str(FigName))
-
-	plt.show()
+	return _finishFigure(grid, FigName, show)
 
 
 
@@ -0,0 +1,218 @@
+import heapq
+import logging
+import numpy as np
+
+from scripts import traversal
+from scripts import linkageList
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+
+
+
+
+class TreeLOD(object):
+	'''
+	Level of detail (LOD) heat maps for large jets. The tree is cut into clusters (subtrees), either at a depth or into
+	a number of clusters, and the heat data of each pair of clusters is aggregated into one block value (mean or max
+	over the pairs of leaves), without building the N x N heat data. Full resolution tiles are computed on demand for a
+	subtree (or a pair of subtrees).
+
+	All the block statistics are obtained from per-node subtree statistics, so the cost is O(N) plus the size of the
+	coarse matrix:
+	- For leaves in different clusters A and B, the LCA of every pair is the LCA of the roots of A and B, at depth L.
+	  Then the full path block mean is mean_A + mean_B - 2L and the max is max_A + max_B - 2L, where mean and max refer
+	  to the leaves depths. For the max steps heat data, max{Si,Sj} = max(di,dj) - L, and
+	  E[max(di,dj)] = D - sum_t F_A(t) F_B(t), with F the cumulative distribution of the leaves depths of each cluster.
+	- Inside a cluster, the pairs of leaves with LCA at an inner node v are n_left(v) * n_right(v), so the sum of the
+	  LCA depths over the pairs is a sum over the inner nodes of the subtree.
+	Diagonal blocks are aggregated over the pairs of different leaves.
+
+	Nodes are labeled by their position in preorder (the truth jet node ids).
+
+	Args:
+	- jet: jet dictionary
+	'''
+
+	def __init__(self, jet):
+		self.preorder, leaves, parent, depth, self.children = traversal.traverse_jet(jet)
+		self.parent, self.depth = traversal.relabel(self.preorder, parent, depth)
+
+		M = len(self.preorder)
+		self.is_leaf = self.children[:, 0] == -1
+		self.N = int(np.count_nonzero(self.is_leaf))
+
+		# Index of the first leaf below each node (leaves are numbered in preorder) and number of leaves below each node
+		self.leaf_start, self.n_leaves = traversal.subtree_leaves(self.children)
+		self.size = 2 * self.n_leaves - 1
+
+		# Depth of the leaves, in preorder
+		self.leaves_depth = self.depth[self.is_leaf].astype(np.int64)
+
+		# Max leaf depth of the subtree below each node, over its (consecutive) leaves
+		bounds = np.stack((self.leaf_start, self.leaf_start + self.n_leaves), axis=1).reshape(-1)
+		self.max_depth = np.maximum.reduceat(np.append(self.leaves_depth, 0), bounds)[::2]
+
+		# Sum of the LCA depths of the (ordered) pairs of leaves with LCA at each node, and max full path between them
+		inner = ~self.is_leaf
+		left, right = self.children[inner, 0], self.children[inner, 1]
+		self.lca_pairs = np.zeros(M, dtype=np.float64)
+		self.lca_pairs[inner] = 2. * self.depth[inner] * self.n_leaves[left] * self.n_leaves[right]
+		self.max_path = np.full(M, -1, dtype=np.int64)
+		self.max_path[inner] = self.max_depth[left] + self.max_depth[right] - 2 * self.depth[inner]
+
+		self._lca_index = None
+		self._tree = jet["tree"]
+		self._root_id = jet["root_id"]
+
+	@property
+	def lca_index(self):
+		'''
+		traversal.LCAIndex of the tree, built the first time it is needed
+		'''
+		if self._lca_index is None:
+			self._lca_index = traversal.LCAIndex(self._tree, self._root_id)
+
+		return self._lca_index
+
+	def cut(self, depth=None, n_clusters=None):
+		'''
+		Cut the tree into clusters (subtrees).
+
+		Args:
+		- depth: the clusters are the nodes at this depth (and the leaves above it).
+		- n_clusters: split the cluster with the most leaves until there are n_clusters (or all clusters are leaves).
+
+		Returns:
+		  roots of the clusters (node positions in preorder), in preorder.
+		'''
+		if depth is not None:
+			roots = np.flatnonzero((self.depth == depth) | (self.is_leaf & (self.depth < depth)))
+
+		elif n_clusters is not None:
+			heap = [(-self.n_leaves[0], 0)]
+			roots = []
+			while heap and len(heap) + len(roots) < n_clusters:
+				n_leaves, node = heapq.heappop(heap)
+				if self.is_leaf[node]:
+					roots.append(node)
+					continue
+
+				for child in self.children[node].tolist():
+					heapq.heappush(heap, (-self.n_leaves[child], child))
+
+			roots = np.sort(np.asarray(roots + [node for n_leaves, node in heap], dtype=np.int64))
+
+		else:
+			raise ValueError("Give the depth or the number of clusters to cut the tree")
+
+		return roots
+
+	def coarse_tree(self, roots):
+		'''
+		Tree above the cut, with the roots of the clusters as leaves, as a jet dictionary (tree and root_id). Node ids
+		are positions in preorder, so the leaves of the coarse tree are the clusters in order.
+		'''
+		top = np.zeros(len(self.preorder), dtype=bool)
+		parent_list = self.parent.tolist()
+		for node in np.asarray(roots).tolist():
+			while node != -1 and not top[node]:
+				top[node] = True
+				node = parent_list[node]
+
+		nodes = np.flatnonzero(top)
+		position = np.full(len(self.preorder) + 1, -1, dtype=np.int64)
+		position[nodes] = np.arange(len(nodes))
+
+		tree = position[self.children[nodes]]
+		# The roots of the clusters are the leaves of the coarse tree
+		tree[position[roots]] = -1
+
+		return {"tree": tree, "root_id": 0}
+
+	def linkage(self, roots):
+		'''
+		Linkage list of the coarse tree (see coarse_tree), to draw the dendrograms of the LOD heat map
+		'''
+		return linkageList.truth_linkage(self.coarse_tree(roots))
+
+	def block_heat(self, roots, full_path=False, statistic="mean"):
+		'''
+		Coarse heat data matrix, with one row and column for each cluster.
+
+		Args:
+		- roots: roots of the clusters, from cut.
+		- full_path: Bool. Heat data definition (see heatClustermap.heat_dendrogram).
+		- statistic: "mean" or "max" of the heat data of the pairs of leaves in each block.
+
+		Returns:
+		  K x K array
+		'''
+		roots = np.asarray(roots, dtype=np.int64)
+		K = len(roots)
+		n = self.n_leaves[roots].astype(np.float64)
+		start = self.leaf_start[roots]
+
+		# Cluster of each leaf
+		cluster = np.repeat(np.arange(K), self.n_leaves[roots])
+		depth_sum = np.bincount(cluster, weights=self.leaves_depth, minlength=K)
+		depth_mean = depth_sum / n
+		depth_max = self.max_depth[roots].astype(np.float64)
+
+		# LCA depth of the roots of each pair of clusters
+		node_ids = self.preorder[roots]
+		lca_depth = self.lca_index.depth[self.lca_index.lca(node_ids[:, None], node_ids[None, :])].astype(np.float64)
+
+		# Sum of the LCA depths over the pairs of different leaves inside each cluster
+		cumulative = np.concatenate(([0.], np.cumsum(self.lca_pairs)))
+		lca_sum = cumulative[roots + self.size[roots]] - cumulative[roots]
+		pairs = n * (n - 1)
+
+		if full_path and statistic == "mean":
+			heat = depth_mean[:, None] + depth_mean[None, :] - 2 * lca_depth
+			diagonal = np.divide(2 * (n - 1) * depth_sum - 2 * lca_sum, pairs, out=np.zeros(K), where=pairs > 0)
+
+		elif full_path and statistic == "max":
+			heat = depth_max[:, None] + depth_max[None, :] - 2 * lca_depth
+			ends = np.stack((roots, roots + self.size[roots]), axis=1).ravel()
+			diagonal = np.maximum.reduceat(np.append(self.max_path, 0), ends)[::2].clip(min=0).astype(np.float64)
+
+		elif statistic == "mean":
+			# E[max(di,dj)] = D - sum_{t<D} F_A(t) F_B(t)
+			D = int(self.leaves_depth.max())
+			histogram = np.zeros((K, D + 1))
+			np.add.at(histogram, (cluster, self.leaves_depth), 1)
+			cdf = np.cumsum(histogram, axis=1)[:, :D] / n[:, None]
+			heat = D - cdf @ cdf.T - lca_depth
+
+			# Sum of max(di,dj) over the pairs of different leaves: 2 * sum_k k * d_(k) with the depths sorted in each cluster
+			order = np.lexsort((self.leaves_depth, cluster))
+			rank = np.arange(self.N) - start[cluster[order]]
+			max_sum = 2 * np.bincount(cluster[order], weights=rank * self.leaves_depth[order], minlength=K)
+			diagonal = np.divide(max_sum - lca_sum, pairs, out=np.zeros(K), where=pairs > 0)
+
+		elif statistic == "max":
+			heat = np.maximum.outer(depth_max, depth_max) - lca_depth
+			diagonal = np.where(n > 1, depth_max - self.depth[roots], 0.)
+
+		else:
+			raise ValueError(f"Unknown statistic: {statistic}")
+
+		heat[np.diag_indices(K)] = diagonal
+
+		return heat
+
+	def tile(self, node, other=None, full_path=False):
+		'''
+		Full resolution heat data for the leaves below node (rows) and below other (columns, node if None).
+		Computed on demand with the LCA index of the tree.
+		'''
+		other = node if other is None else other
+		rows = np.arange(self.leaf_start[node], self.leaf_start[node] + self.n_leaves[node])
+		cols = np.arange(self.leaf_start[other], self.leaf_start[other] + self.n_leaves[other])
+
+		if full_path:
+			return self.lca_index.path_length(rows[:, None], cols[None, :]).astype(np.float64)
+
+		return self.lca_index.max_steps(rows[:, None], cols[None, :]).astype(np.float64)
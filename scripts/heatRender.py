@@ -0,0 +1,173 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import logging
+from matplotlib.collections import LineCollection
+
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+
+
+
+
+def dendrogram_order(linkage_list):
+	'''
+	Leaves order of the dendrogram of a linkage list, with the same convention as scipy.cluster.hierarchy.dendrogram
+	(for each row, the cluster in column 0 goes to the left of the cluster in column 1). It only follows the tree
+	of the linkage list from the root, so it is O(N) and does not compute the dendrogram layout.
+
+	Args:
+	- linkage_list: (n - 1) by 4 linkage list
+
+	Returns:
+	  array with the leaves in the order in which they are drawn
+	'''
+
+	linkage_list = np.asarray(linkage_list)
+	Nleaves = len(linkage_list) + 1
+	merges = linkage_list[:, :2].astype(np.int64).tolist()
+
+	order = []
+	stack = [2 * Nleaves - 2]
+	while stack:
+		cluster = stack.pop()
+		if cluster < Nleaves:
+			order.append(cluster)
+		else:
+			left, right = merges[cluster - Nleaves]
+			stack.append(right)
+			stack.append(left)
+
+	return np.asarray(order, dtype=np.int64)
+
+
+
+
+
+
+def dendrogram_segments(linkage_list, order=None):
+	'''
+	Line segments of the dendrogram of a linkage list, with the leaves at positions 0.5, 1.5, ... (the centers of the
+	heat map pixels) following order, and the distance of the linkage list as height. Each row gives 3 segments (the
+	2 vertical lines and the horizontal line at the height of the merge).
+
+	Args:
+	- linkage_list: (n - 1) by 4 linkage list
+	- order: (optional) leaves order, from dendrogram_order
+
+	Returns:
+	  array of shape (3 * (n - 1), 2, 2) with the (position, height) of the ends of each segment
+	'''
+
+	linkage_list = np.asarray(linkage_list, dtype=np.float64)
+	Nleaves = len(linkage_list) + 1
+	if order is None:
+		order = dendrogram_order(linkage_list)
+
+	position = np.zeros(2 * Nleaves - 1)
+	position[order] = np.arange(Nleaves) + 0.5
+	height = np.zeros(2 * Nleaves - 1)
+	height[Nleaves:] = linkage_list[:, 2]
+
+	left = linkage_list[:, 0].astype(np.int64)
+	right = linkage_list[:, 1].astype(np.int64)
+
+	# Clusters are formed after their children, so each position only depends on previous rows
+	position_list = position.tolist()
+	for k, (left_cluster, right_cluster) in enumerate(zip(left.tolist(), right.tolist())):
+		position_list[Nleaves + k] = (position_list[left_cluster] + position_list[right_cluster]) / 2
+	position = np.asarray(position_list)
+
+	x_left, x_right = position[left], position[right]
+	y_left, y_right, y = height[left], height[right], linkage_list[:, 2]
+
+	segments = np.stack([
+		np.stack([np.stack([x_left, y_left], axis=1), np.stack([x_left, y], axis=1)], axis=1),
+		np.stack([np.stack([x_left, y], axis=1), np.stack([x_right, y], axis=1)], axis=1),
+		np.stack([np.stack([x_right, y], axis=1), np.stack([x_right, y_right], axis=1)], axis=1),
+	], axis=1)
+
+	return segments.reshape(-1, 2, 2)
+
+
+
+
+
+
+def clustermap(
+		data,
+		row_linkage = None,
+		col_linkage = None,
+		row_cluster = True,
+		col_cluster = True,
+		cmap = "magma",
+		figsize = (10, 10),
+		dendrogram_ratio = 0.2,
+):
+	'''
+	Lightweight version of seaborn.clustermap for precomputed linkage lists. The rows and columns are reordered
+	following the leaves order of the dendrograms, the matrix is drawn with a single imshow and each dendrogram with a
+	single LineCollection. There is no clustering or dendrogram layout computation.
+
+	Args:
+	- data: N x N heat data matrix
+	- row_linkage, col_linkage: linkage lists for the rows and the columns
+	- row_cluster, col_cluster: Bool. If True, reorder the rows (columns) and draw the row (column) dendrogram.
+	- cmap: matplotlib colormap
+	- figsize: figure size
+	- dendrogram_ratio: fraction of the figure size used for the dendrograms
+
+	Returns:
+	  matplotlib figure
+	'''
+
+	data = np.asarray(data)
+	fig = plt.figure(figsize=figsize)
+
+	# Axes layout: [row dendrogram | heat map | leaf labels | colorbar], with the column dendrogram above the heat map
+	left = dendrogram_ratio if row_cluster else 0.05
+	top = 1 - dendrogram_ratio if col_cluster else 0.95
+	heat_ax = fig.add_axes([left, 0.05, 0.86 - left, top - 0.05])
+	cbar_ax = fig.add_axes([0.93, 0.05, 0.02, top - 0.05])
+
+	row_order = np.arange(data.shape[0])
+	col_order = np.arange(data.shape[1])
+
+	if row_cluster and row_linkage is not None and len(row_linkage):
+		row_order = dendrogram_order(row_linkage)
+		row_ax = fig.add_axes([0.01, 0.05, left - 0.02, top - 0.05])
+		segments = dendrogram_segments(row_linkage, order=row_order)[:, :, ::-1] # (height, position)
+		row_ax.add_collection(LineCollection(segments, colors="k", linewidths=0.8))
+		row_ax.set_xlim(segments[:, :, 0].max() * 1.05, 0)
+		row_ax.set_ylim(data.shape[0], 0)
+		row_ax.set_axis_off()
+
+	if col_cluster and col_linkage is not None and len(col_linkage):
+		col_order = dendrogram_order(col_linkage)
+		col_ax = fig.add_axes([left, top + 0.01, 0.86 - left, 0.98 - top])
+		segments = dendrogram_segments(col_linkage, order=col_order)
+		col_ax.add_collection(LineCollection(segments, colors="k", linewidths=0.8))
+		col_ax.set_xlim(0, data.shape[1])
+		col_ax.set_ylim(0, segments[:, :, 1].max() * 1.05)
+		col_ax.set_axis_off()
+
+	image = heat_ax.imshow(data[np.ix_(row_order, col_order)],
+	                       cmap=cmap,
+	                       aspect="auto",
+	                       interpolation="nearest",
+	                       extent=(0, data.shape[1], data.shape[0], 0))
+
+	# Leaf labels, only when they can be read
+	if data.shape[1] <= 50:
+		heat_ax.set_xticks(np.arange(data.shape[1]) + 0.5, labels=col_order)
+	else:
+		heat_ax.set_xticks([])
+	if data.shape[0] <= 50:
+		heat_ax.set_yticks(np.arange(data.shape[0]) + 0.5, labels=row_order)
+	else:
+		heat_ax.set_yticks([])
+	heat_ax.yaxis.tick_right()
+	fig.colorbar(image, cax=cbar_ax)
+
+	return fig
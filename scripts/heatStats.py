@@ -0,0 +1,176 @@
+import logging
+import numpy as np
+
+from scripts import traversal
+from scripts import reclusterTree
+from scripts import heatClustermap
+from scripts import treeMetrics
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+
+
+
+
+class RunningStats(object):
+	'''
+	Welford running mean and variance of an array of values (or a scalar, with shape=()), updated one sample at a time.
+	With a mask, only the entries where the mask is True are updated (e.g. for jets with fewer leaves than the array).
+	Two RunningStats can be merged (e.g. from different processes) with Chan's parallel formula.
+	'''
+
+	def __init__(self, shape=()):
+		self.count = np.zeros(shape, dtype=np.int64)
+		self.mean = np.zeros(shape, dtype=np.float64)
+		self.M2 = np.zeros(shape, dtype=np.float64)
+
+	def update(self, x, mask=None):
+		x = np.asarray(x, dtype=np.float64)
+		mask = np.ones(self.count.shape, dtype=bool) if mask is None else mask
+
+		self.count = self.count + mask
+		delta = np.where(mask, x - self.mean, 0.)
+		self.mean = self.mean + np.divide(delta, self.count, out=np.zeros(self.count.shape), where=self.count > 0)
+		self.M2 = self.M2 + delta * np.where(mask, x - self.mean, 0.)
+
+	def merge(self, other):
+		count = self.count + other.count
+		delta = other.mean - self.mean
+		safe_count = np.maximum(count, 1)
+
+		self.mean = self.mean + delta * other.count / safe_count
+		self.M2 = self.M2 + other.M2 + delta ** 2 * self.count * other.count / safe_count
+		self.count = count
+
+	@property
+	def variance(self):
+		'''
+		Sample variance (nan where there are less than 2 samples)
+		'''
+		return np.divide(self.M2, self.count - 1, out=np.full(self.count.shape, np.nan), where=self.count > 1)
+
+
+
+
+
+
+class HeatDiffAggregator(object):
+	'''
+	Streaming dataset-level statistics of the difference between the truth jet heat data and the heat data of the jet
+	reclustered with an algorithm (truth - reclustered, with the leaves in the truth jet order). Jets are consumed one at a
+	time, so memory does not depend on the number of jets:
+	- by_multiplicity: for each number of constituents N, running mean and variance (over the jets) of the mean heat
+	  difference and of the mean absolute heat difference over the pairs of different leaves of a jet.
+	- by_pt_rank: running mean and variance of the heat difference for each pair of leaves ranked by pT (rank 0 is the
+	  leaf with the highest pT), for the max_rank leading leaves.
+
+	Args:
+	- alpha: algorithm to recluster the truth jets. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
+	- full_path: Bool. Heat data definition (see heatClustermap.heat_dendrogram).
+	- max_rank: number of leading pT leaves kept in by_pt_rank.
+	- method: clustering engine (see reclusterTree.recluster).
+	'''
+
+	def __init__(self, alpha=1, full_path=False, max_rank=20, method="matrix"):
+		self.alpha = alpha
+		self.full_path = full_path
+		self.max_rank = max_rank
+		self.method = method
+
+		self.n_jets = 0
+		self.by_multiplicity = {}
+		self.by_pt_rank = RunningStats((max_rank, max_rank))
+
+	def heat_difference(self, truth_jet):
+		'''
+		Truth - reclustered heat data of a jet, with the leaves in the truth jet order
+		'''
+		reclustered = reclusterTree.recluster(truth_jet, alpha=self.alpha, save=False, method=self.method)
+
+		truth_heat = heatClustermap.getHeatData(truth_jet)[0 if self.full_path else 1]
+		recluster_heat = heatClustermap.getHeatData(reclustered)[0 if self.full_path else 1]
+
+		order = treeMetrics.truth_order(reclustered)
+
+		return truth_heat - recluster_heat[np.ix_(order, order)]
+
+	def update(self, truth_jet):
+		'''
+		Add one truth jet to the statistics
+		'''
+		diff = self.heat_difference(truth_jet)
+		N = len(diff)
+
+		# Mean over the pairs of different leaves
+		if N > 1:
+			pairs = N * (N - 1)
+			if N not in self.by_multiplicity:
+				self.by_multiplicity[N] = RunningStats((2,))
+			self.by_multiplicity[N].update([diff.sum() / pairs, np.absolute(diff).sum() / pairs])
+
+		# Leaves ranked by pT, with pT=|py| (as in the clustering)
+		preorder, leaves, parent, depth, children = traversal.traverse_jet(truth_jet)
+		pt = np.absolute(np.asarray(truth_jet["content"])[leaves, 0])
+		rank_order = np.argsort(-pt, kind="stable")[:self.max_rank]
+		R = len(rank_order)
+
+		ranked = np.zeros((self.max_rank, self.max_rank))
+		ranked[:R, :R] = diff[np.ix_(rank_order, rank_order)]
+		mask = np.zeros((self.max_rank, self.max_rank), dtype=bool)
+		mask[:R, :R] = True
+
+		self.by_pt_rank.update(ranked, mask=mask)
+		self.n_jets += 1
+
+	def consume(self, jets, log_every=None):
+		'''
+		Add all the jets of an iterable (e.g. a generator reading them from disk) to the statistics
+		'''
+		for jet in jets:
+			self.update(jet)
+
+			if log_every and self.n_jets % log_every == 0:
+				logger.info(f"Heat difference statistics: {self.n_jets} jets")
+
+		return self
+
+	def merge(self, other):
+		'''
+		Add the statistics of another aggregator (e.g. computed in another process on a different part of the dataset)
+		'''
+		for N, stats in other.by_multiplicity.items():
+			if N not in self.by_multiplicity:
+				self.by_multiplicity[N] = RunningStats((2,))
+			self.by_multiplicity[N].merge(stats)
+
+		self.by_pt_rank.merge(other.by_pt_rank)
+		self.n_jets += other.n_jets
+
+		return self
+
+	def summary(self):
+		'''
+		Returns:
+		 dictionary with
+		 - "multiplicity": array with the values of N
+		 - "n_jets", "mean", "variance", "mean_abs", "variance_abs": arrays with one entry for each value of N
+		 - "pt_rank_count", "pt_rank_mean", "pt_rank_variance": max_rank x max_rank arrays
+		'''
+		multiplicity = np.asarray(sorted(self.by_multiplicity), dtype=np.int64)
+		stats = [self.by_multiplicity[N] for N in multiplicity]
+
+		def _column(values, k):
+			return np.asarray([value[k] for value in values], dtype=np.float64)
+
+		return {
+			"multiplicity": multiplicity,
+			"n_jets": np.asarray([entry.count[0] for entry in stats], dtype=np.int64),
+			"mean": _column([entry.mean for entry in stats], 0),
+			"variance": _column([entry.variance for entry in stats], 0),
+			"mean_abs": _column([entry.mean for entry in stats], 1),
+			"variance_abs": _column([entry.variance for entry in stats], 1),
+			"pt_rank_count": self.by_pt_rank.count,
+			"pt_rank_mean": self.by_pt_rank.mean,
+			"pt_rank_variance": self.by_pt_rank.variance,
+		}
@@ -0,0 +1,370 @@
+import os
+import re
+import json
+import glob
+import pickle
+import shutil
+import struct
+import logging
+import numpy as np
+
+from scripts import traversal
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+# File layout: MAGIC, column blocks (each aligned to ALIGN bytes), JSON footer, footer length (uint64) and MAGIC
+MAGIC = b"JETSTOR1"
+ALIGN = 64
+
+# Ragged columns of the jet dictionaries, with one row for each node, each leaf or each merge (linkage list row)
+node_columns = ("tree", "content", "deltas", "draws", "parent", "depth", "ancestor_labels")
+leaf_columns = ("node_id", "ancestor_leaves")
+merge_columns = ("linkage_list",)
+
+# Keys rebuilt when reading a jet (see JetStore.jet)
+derived_keys = ("tree_ancestors",)
+
+
+
+
+
+class JetStoreWriter(object):
+	'''
+	Write jet dictionaries to a packed store: one file for a dataset, where each column (tree, content, linkage_list,
+	...) is the concatenation of the arrays of all the jets, with CSR-style offsets for each jet, and an index by jet
+	name and algorithm. Jets are appended one at a time to a temporary file for each column, so memory does not
+	depend on the number of jets, and the store is assembled when the writer is closed.
+
+	Scalar values of the jets (root_id, Nconst, Delta_0, ...) are kept in the footer. Other values that are not
+	columns (e.g. torch tensors with more than one entry) are not stored.
+
+	Args:
+	- path: output file (e.g. data/jets.jetstore).
+
+	Usage:
+	  with JetStoreWriter("data/jets.jetstore") as writer:
+	      writer.append(truth_jet, name="tree_0", algorithm="truth")
+	'''
+
+	def __init__(self, path):
+		self.path = path
+		self.names = []
+		self.algorithms = []
+		self.attrs = []
+		self.columns = {}
+		self._files = {}
+
+	def append(self, jet, name=None, algorithm=None):
+		'''
+		Append a jet dictionary. name and algorithm default to jet["name"] and jet["algorithm"].
+		'''
+		j = len(self.names)
+		name = str(jet.get("name", j) if name is None else name)
+		algorithm = jet.get("algorithm") if algorithm is None else algorithm
+
+		values = dict(jet)
+		values.update(_ancestorColumns(jet))
+
+		attrs = {}
+		for key, value in values.items():
+			if key in node_columns + leaf_columns + merge_columns:
+				self._appendColumn(key, j, value)
+
+			elif key not in derived_keys + ("name", "algorithm") and np.ndim(value) == 0:
+				value = value.item() if hasattr(value, "item") else value
+				if isinstance(value, (int, float, str, bool)) or value is None:
+					attrs[key] = value
+
+		self.names.append(name)
+		self.algorithms.append(str(algorithm))
+		self.attrs.append(attrs)
+
+	def _appendColumn(self, key, j, value):
+		value = np.asarray(value)
+		if value.ndim == 1 and key in ("tree", "content", "linkage_list") and value.size == 0:
+			value = value.reshape(0, 2 if key != "linkage_list" else 4)
+
+		if key not in self.columns:
+			self.columns[key] = {"dtype": value.dtype.str, "shape": value.shape[1:], "rows": 0, "offsets": [0] * (j + 1),
+			                     "present": [False] * j}
+			self._files[key] = open(f"{self.path}.{key}.tmp", "wb")
+
+		column = self.columns[key]
+		# Jets without this column have no rows
+		column["offsets"] += [column["rows"]] * (j + 1 - len(column["offsets"]))
+		column["present"] += [False] * (j - len(column["present"]))
+
+		if value.size > 0 and value.shape[1:] != tuple(column["shape"]):
+			raise ValueError(f"Column {key} of jet {j} has rows of shape {value.shape[1:]}, expected {tuple(column['shape'])}")
+
+		dtype = np.result_type(np.dtype(column["dtype"]), value.dtype)
+		if dtype.str != column["dtype"]:
+			self._promoteColumn(key, dtype)
+
+		value = np.ascontiguousarray(value, dtype=column["dtype"]).reshape((-1,) + tuple(column["shape"]))
+		self._files[key].write(value.tobytes())
+		column["rows"] += len(value)
+		column["offsets"].append(column["rows"])
+		column["present"].append(True)
+
+	def _promoteColumn(self, key, dtype):
+		'''
+		Cast the rows already written to a column to a wider dtype (e.g. float32 to float64), so that values are not
+		downcast when a later jet has a wider dtype than the first one
+		'''
+		column = self.columns[key]
+		self._files[key].close()
+
+		tmp_path = f"{self.path}.{key}.tmp"
+		data = np.fromfile(tmp_path, dtype=column["dtype"]).astype(dtype)
+		data.tofile(tmp_path)
+
+		self._files[key] = open(tmp_path, "ab")
+		column["dtype"] = dtype.str
+
+	def discard(self):
+		'''
+		Remove the temporary files without writing the store (e.g. if an error was raised while appending jets)
+		'''
+		for key, f in self._files.items():
+			f.close()
+			if os.path.exists(f"{self.path}.{key}.tmp"):
+				os.remove(f"{self.path}.{key}.tmp")
+
+		self._files = {}
+		self.columns = {}
+
+	def close(self):
+		'''
+		Assemble the store file and remove the temporary files
+		'''
+		J = len(self.names)
+		footer = {"n_jets": J, "names": self.names, "algorithms": self.algorithms, "attrs": self.attrs, "columns": {}}
+
+		with open(self.path, "wb") as f:
+			f.write(MAGIC)
+
+			for key, column in self.columns.items():
+				self._files[key].close()
+				column["offsets"] += [column["rows"]] * (J + 1 - len(column["offsets"]))
+				column["present"] += [False] * (J - len(column["present"]))
+
+				blocks = {}
+				for block, data in (("data", None),
+				                    ("offsets", np.asarray(column["offsets"], dtype=np.int64)),
+				                    ("present", np.asarray(column["present"], dtype=bool))):
+					f.write(b"\0" * (-f.tell() % ALIGN))
+					blocks[block] = f.tell()
+
+					if data is None:
+						with open(f"{self.path}.{key}.tmp", "rb") as tmp:
+							shutil.copyfileobj(tmp, f)
+					else:
+						f.write(data.tobytes())
+
+				os.remove(f"{self.path}.{key}.tmp")
+				footer["columns"][key] = {"dtype": column["dtype"], "shape": list(column["shape"]), "rows": column["rows"],
+				                          "blocks": blocks}
+
+			footer = json.dumps(footer).encode()
+			f.write(footer)
+			f.write(struct.pack("<Q", len(footer)))
+			f.write(MAGIC)
+
+		logger.info(f"Saved {J} jets to {self.path}")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		# Only write the store if the jets were appended without errors
+		if exc[0] is None:
+			self.close()
+		else:
+			self.discard()
+
+
+
+
+
+
+class JetStore(object):
+	'''
+	Read-only access to a packed jet store (see JetStoreWriter). Each column is memory mapped, so a jet is a set of views
+	of its rows in the columns: nothing is loaded or copied until the arrays are used, and reading one jet does not load
+	the others.
+
+	Jets are accessed by position (store[i]), by name and algorithm (store["tree_0", "truth"], store.get(...)) or by
+	iterating over the store. The algorithm of reclustered jets is the value of alpha (-1, 0, 1), and "truth" for the
+	truth jets.
+
+	Args:
+	- path: store file.
+	'''
+
+	def __init__(self, path):
+		self.path = path
+
+		with open(path, "rb") as f:
+			if f.read(len(MAGIC)) != MAGIC:
+				raise ValueError(f"{path} is not a jet store")
+			f.seek(-len(MAGIC) - 8, os.SEEK_END)
+			footer_size = struct.unpack("<Q", f.read(8))[0]
+			f.seek(-len(MAGIC) - 8 - footer_size, os.SEEK_END)
+			footer = json.loads(f.read(footer_size).decode())
+
+		self.names = footer["names"]
+		self.algorithms = [_algorithm(algorithm) for algorithm in footer["algorithms"]]
+		self.attrs = footer["attrs"]
+		self.index = {(name, algorithm): j for j, (name, algorithm) in enumerate(zip(self.names, self.algorithms))}
+
+		# One memory map of the file. The blocks are aligned, so each column is a view of it
+		self._buffer = np.memmap(path, dtype=np.uint8, mode="r")
+
+		self.columns = {}
+		for key, column in footer["columns"].items():
+			J = footer["n_jets"]
+			blocks = column["blocks"]
+			self.columns[key] = (
+				self._view(column["dtype"], (column["rows"],) + tuple(column["shape"]), blocks["data"]),
+				self._view(np.int64, (J + 1,), blocks["offsets"]),
+				self._view(bool, (J,), blocks["present"]),
+			)
+
+	def _view(self, dtype, shape, offset):
+		dtype = np.dtype(dtype)
+		nbytes = int(np.prod(shape)) * dtype.itemsize
+
+		return self._buffer[offset:offset + nbytes].view(dtype).reshape(shape)
+
+	def __len__(self):
+		return len(self.names)
+
+	def __contains__(self, key):
+		return (str(key[0]), _algorithm(key[1])) in self.index
+
+	def __getitem__(self, key):
+		if isinstance(key, tuple):
+			key = self.index[str(key[0]), _algorithm(key[1])]
+
+		return self.jet(key)
+
+	def __iter__(self):
+		for j in range(len(self)):
+			yield self.jet(j)
+
+	def __repr__(self):
+		return "JetStore(%s, %d jets)" % (self.path, len(self))
+
+	def keys(self):
+		'''
+		(name, algorithm) of each jet
+		'''
+		return list(zip(self.names, self.algorithms))
+
+	def get(self, name, algorithm="truth", default=None):
+		j = self.index.get((str(name), _algorithm(algorithm)))
+
+		return default if j is None else self.jet(j)
+
+	def jet(self, j):
+		'''
+		Jet dictionary at position j, with read-only memory mapped arrays
+		'''
+		if j < 0:
+			j += len(self)
+
+		jet = dict(self.attrs[j])
+		jet["name"] = self.names[j]
+		jet["algorithm"] = self.algorithms[j]
+
+		for key, (data, offsets, present) in self.columns.items():
+			if present[j]:
+				jet[key] = data[offsets[j]:offsets[j + 1]]
+
+		# Lazy tree ancestors, from the parent array and the labels of the nodes (see _ancestorColumns)
+		if "ancestor_leaves" in jet:
+			jet["tree_ancestors"] = traversal.TreeAncestors(jet["parent"],
+			                                                jet.pop("ancestor_leaves"),
+			                                                labels=jet.pop("ancestor_labels"))
+
+		return jet
+
+
+
+
+
+
+def pack_pickles(pattern, path):
+	'''
+	Pack jet pickle files (e.g. the data/tree_{id}_{algorithm}.pkl files saved by reclusterTree.recluster) into one jet
+	store. The name and algorithm of each jet are taken from the file name. Files with a list of jets (e.g. the truth
+	jets) store its first entry.
+
+	Args:
+	- pattern: glob pattern of the pickle files, e.g. "data/*.pkl".
+	- path: output store file.
+
+	Returns:
+	  number of packed jets
+	'''
+	files = sorted(glob.glob(pattern))
+
+	with JetStoreWriter(path) as writer:
+		for filename in files:
+			with open(filename, "rb") as f:
+				jet = pickle.load(f, encoding="latin-1")
+			if isinstance(jet, list):
+				jet = jet[0]
+
+			match = re.match(r"(.*)_([^_]+)\.pkl$", os.path.basename(filename))
+			name, algorithm = match.groups() if match else (os.path.basename(filename), None)
+			writer.append(jet, name=name, algorithm=jet.get("algorithm", algorithm) if algorithm is None else algorithm)
+
+	return len(files)
+
+
+
+
+
+
+def _ancestorColumns(jet):
+	'''
+	Columns to rebuild jet["tree_ancestors"] as a traversal.TreeAncestors view: the leaves, the label of each node (the
+	node ids of the clustering history for reclustered jets) and the parent array. Lists of tree ancestors arrays (e.g.
+	from older pickle files) are converted by reading the labels along the path from the root to each leaf.
+	'''
+	tree_ancestors = jet.get("tree_ancestors")
+
+	if isinstance(tree_ancestors, traversal.TreeAncestors):
+		parent, leaves, labels = tree_ancestors.parent, tree_ancestors.leaves, tree_ancestors.labels
+		if labels is None:
+			labels = np.arange(len(parent))
+
+	elif tree_ancestors is not None and len(tree_ancestors) > 0:
+		preorder, leaves, parent, depth, children = traversal.traverse(jet["tree"], jet["root_id"])
+		labels = np.full(len(parent), -1, dtype=np.int64)
+		for path, entry in zip(traversal.ancestors(parent, leaves), tree_ancestors):
+			labels[np.asarray(path, dtype=np.int64)] = np.asarray(entry, dtype=np.int64)
+
+	else:
+		return {}
+
+	return {"parent": parent, "ancestor_leaves": leaves, "ancestor_labels": labels}
+
+
+
+
+
+
+def _algorithm(algorithm):
+	'''
+	Algorithm label as stored in the jet dictionaries: "truth" (or any other name), or the value of alpha
+	'''
+	try:
+		alpha = float(algorithm)
+	except (TypeError, ValueError):
+		return algorithm
+
+	return int(alpha) if alpha.is_integer() else alpha
@@ -0,0 +1,257 @@
+import os
+import json
+import glob
+import pickle
+import logging
+import itertools
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts import jetStore
+from scripts import linkageList
+from scripts import reclusterTree
+from scripts import treeMetrics
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+
+
+
+
+def iter_jets(path):
+	'''
+	Generator over the jets of one or more files (path can be a glob pattern), reading one jet at a time:
+	- record files (written with write_jets, or by run_pipeline): a sequence of pickled jet dictionaries, loaded one by
+	  one, so only the current jet is in memory.
+	- legacy files with a pickled list of jets (e.g. the truth jets pickles): the list is loaded once and its jets are
+	  yielded one at a time. Convert them with write_jets to read them incrementally.
+	- jet stores (see jetStore.JetStore): memory mapped jets.
+	'''
+	for filename in sorted(glob.glob(path)) or [path]:
+
+		with open(filename, "rb") as f:
+			is_store = f.read(len(jetStore.MAGIC)) == jetStore.MAGIC
+
+		if is_store:
+			for jet in jetStore.JetStore(filename):
+				yield jet
+			continue
+
+		with open(filename, "rb") as f:
+			while True:
+				try:
+					record = pickle.load(f, encoding="latin-1")
+				except EOFError:
+					break
+
+				if isinstance(record, list):
+					logger.debug(f"{filename} is a list of jets, loaded at once")
+					for jet in record:
+						yield jet
+				else:
+					yield record
+
+
+
+
+
+
+def write_jets(jets, path, append=False):
+	'''
+	Write jets (any iterable, e.g. iter_jets of a legacy list file) as a record file that iter_jets reads one jet at a
+	time.
+
+	Returns:
+	  number of jets written
+	'''
+	n_jets = 0
+	with open(path, "ab" if append else "wb") as f:
+		for jet in jets:
+			pickle.dump(jet, f, protocol=2)
+			n_jets += 1
+
+	return n_jets
+
+
+
+
+
+
+def read_metrics(out_dir):
+	'''
+	Metrics written by run_pipeline, as a structured array (treeMetrics.metrics_dtype)
+	'''
+	return np.fromfile(os.path.join(out_dir, "metrics.dat"), dtype=treeMetrics.metrics_dtype)
+
+
+
+
+
+
+def run_pipeline(
+		jets,
+		out_dir,
+		alphas = (1, 0, -1),
+		full_path = False,
+		batch_size = 64,
+		n_jobs = None,
+		method = "matrix",
+		save_jets = True,
+		resume = True,
+):
+	'''
+	Stream truth jets through the recluster, linkage and metrics stages, writing the outputs as they are produced, so
+	the memory footprint does not depend on the number of jets. The jets are read in batches of batch_size, and each
+	batch is split over a process pool; at most 2 batches are in flight at a time.
+
+	Outputs (in out_dir):
+	- reclustered.pkl: record file (see iter_jets) with the reclustered jets (with "name" and "algorithm"), if save_jets.
+	- metrics.dat: rows of treeMetrics.metrics_dtype for each jet and algorithm (see read_metrics). Rows of jets that
+	  failed have nan metrics.
+	- checkpoint.json: number of processed jets and size of the outputs, updated after each batch.
+
+	With resume, a previous run in out_dir continues from its last checkpoint: the outputs are truncated to the
+	checkpoint and the processed jets are skipped.
+
+	Args:
+	- jets: iterable of truth jet dictionaries (e.g. iter_jets(path)).
+	- out_dir: dir for the outputs.
+	- alphas: values of alpha to recluster each jet. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
+	- full_path: Bool. Heat data definition (see heatClustermap.heat_dendrogram).
+	- batch_size: number of jets read at a time.
+	- n_jobs: number of worker processes. If None, use all the cores. If 1, run in the current process.
+	- method: clustering engine (see reclusterTree.recluster).
+	- save_jets: if True, save the reclustered jets.
+	- resume: if True, continue from the checkpoint of a previous run.
+
+	Returns:
+	  number of processed jets (including the jets of a resumed run)
+	'''
+	os.makedirs(out_dir, exist_ok=True)
+	n_jobs = n_jobs or os.cpu_count() or 1
+	alphas = tuple(alphas)
+
+	jets_path = os.path.join(out_dir, "reclustered.pkl")
+	metrics_path = os.path.join(out_dir, "metrics.dat")
+	checkpoint_path = os.path.join(out_dir, "checkpoint.json")
+
+	checkpoint = {"n_jets": 0, "jets_size": 0, "metrics_size": 0}
+	if resume and os.path.exists(checkpoint_path):
+		with open(checkpoint_path) as f:
+			checkpoint = json.load(f)
+		logger.info(f"Resuming from jet {checkpoint['n_jets']}")
+	elif os.path.exists(checkpoint_path):
+		os.remove(checkpoint_path)
+
+	# Drop the outputs written after the checkpoint
+	for path, size in ((jets_path, checkpoint["jets_size"]), (metrics_path, checkpoint["metrics_size"])):
+		with open(path, "ab") as f:
+			f.truncate(size)
+
+	jets = itertools.islice(iter(jets), checkpoint["n_jets"], None)
+	n_done = checkpoint["n_jets"]
+
+	executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+
+	def _submit(batch, start):
+		tasks = [(start + k, jet, alphas, full_path, method, save_jets) for k, jet in enumerate(batch)]
+		if executor is None:
+			return map(_pipelineWorker, tasks)
+
+		return executor.map(_pipelineWorker, tasks, chunksize=max(1, len(tasks) // (4 * n_jobs)))
+
+	try:
+		with open(jets_path, "ab") as jets_file, open(metrics_path, "ab") as metrics_file:
+
+			def _write(batch, results):
+				for k, result in enumerate(results):
+					i = n_done + k
+
+					if isinstance(result, Exception):
+						logger.warning(f"Pipeline failed for jet {i}: {result!r}")
+						name = str(batch[k].get("name", i))
+						reclustered, rows = [], [(i, name, alpha, -1, np.nan, -1, np.nan, np.nan) for alpha in alphas]
+					else:
+						reclustered, rows = result
+
+					for jet in reclustered:
+						pickle.dump(jet, jets_file, protocol=2)
+					metrics_file.write(np.asarray(rows, dtype=treeMetrics.metrics_dtype).tobytes())
+
+				_checkpoint(checkpoint_path, n_done + len(batch), jets_file, metrics_file)
+				logger.info(f"Pipeline: {n_done + len(batch)} jets")
+
+				return n_done + len(batch)
+
+			# Keep the next batch running while the outputs of the current one are written
+			in_flight = collections.deque()
+			start = n_done
+			while True:
+				batch = list(itertools.islice(jets, batch_size))
+				if not batch:
+					break
+
+				in_flight.append((batch, _submit(batch, start)))
+				start += len(batch)
+
+				if len(in_flight) == 2:
+					n_done = _write(*in_flight.popleft())
+
+			while in_flight:
+				n_done = _write(*in_flight.popleft())
+
+	finally:
+		if executor is not None:
+			executor.shutdown(cancel_futures=True)
+
+	return n_done
+
+
+
+
+
+
+def _checkpoint(path, n_jets, jets_file, metrics_file):
+	'''
+	Flush the outputs and save the checkpoint (written to a temporary file and renamed, so it is never partial)
+	'''
+	for f in (jets_file, metrics_file):
+		f.flush()
+		os.fsync(f.fileno())
+
+	with open(path + ".tmp", "w") as f:
+		json.dump({"n_jets": n_jets, "jets_size": jets_file.tell(), "metrics_size": metrics_file.tell()}, f)
+	os.replace(path + ".tmp", path)
+
+
+
+
+
+
+def _pipelineWorker(task):
+	'''
+	Recluster, linkage and metrics stages for one jet. Exceptions are returned instead of raised.
+	'''
+	i, truth_jet, alphas, full_path, method, save_jets = task
+
+	try:
+		name = str(truth_jet.get("name", i))
+		reclustered = reclusterTree.recluster_multi(truth_jet, alphas=alphas, save=False, method=method)
+		truth_linkage = linkageList.truth_linkage(truth_jet)
+
+		rows = [(i, name, alpha, reclustered[alpha]["Nconst"]) +
+		        treeMetrics.tree_metrics(truth_jet, reclustered[alpha], full_path=full_path, truth_linkage=truth_linkage)
+		        for alpha in alphas]
+
+		jets = []
+		if save_jets:
+			for alpha in alphas:
+				reclustered[alpha]["name"] = name
+				jets.append(reclustered[alpha])
+
+		return jets, rows
+
+	except Exception as error:
+		return error
@@ -0,0 +1,196 @@
+import logging
+import numpy as np
+
+from scripts import traversal
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+
+
+
+
+class JetTree(object):
+	'''
+	Compact jet: the tree (int32 [left, right] children of each node, -1 for the leaves) and the content (momentum of
+	each node, kept in its float dtype, float64 for non-float input) in contiguous arrays, the root_id, and a
+	dictionary of other fields (name, algorithm, deltas, node_id, Nconst, linkage_list, ...).
+
+	Derived fields are computed the first time they are needed and cached, so all the functions that get the same
+	JetTree share them instead of traversing the tree again:
+	- traversal (see traversal.traverse), preorder, leaves, parent, depth and lca_index (see traversal.LCAIndex).
+	- linkage: the "linkage_list" field if given (e.g. reclustered jets), otherwise linkageList.truth_linkage.
+
+	A JetTree can be used where the functions of this package take a jet dictionary: jet["key"], jet.get(...),
+	"key" in jet, jet.keys() and jet["key"] = value work as for the dictionaries. The keys added by
+	linkageList.runTraverse_jet and linkageList.draw_truth ("parent", "depth", "outers_list", "outers_node_id",
+	"parent_child", "tree_ancestors", "linkage_list") are derived fields, so those functions do not modify a JetTree.
+	Setting one of them stores it as a field, and setting "tree", "content" or "root_id" clears the cache.
+
+	Pickling (and copy.deepcopy) only keeps the arrays, the root_id and the fields. The cache is rebuilt on demand.
+
+	Args:
+	- tree: [left, right] children of each node.
+	- content: momentum of each node.
+	- root_id: node id of the root.
+	- fields: (optional) dictionary with the other fields.
+	'''
+
+	__slots__ = ("tree", "content", "root_id", "fields", "_cache")
+
+	# Keys of the legacy jet dictionaries that are computed from the tree
+	derived_keys = ("parent", "depth", "outers_list", "outers_node_id", "parent_child", "tree_ancestors", "linkage_list")
+
+	def __init__(self, tree, content, root_id=0, fields=None):
+		self.tree = np.ascontiguousarray(np.asarray(tree).reshape(-1, 2), dtype=np.int32)
+		# Float32 contents (e.g. the truth jets pickles) are kept as they are, so reclustering gives the same trees
+		content = np.asarray(content)
+		self.content = np.ascontiguousarray(content, dtype=content.dtype if content.dtype.kind == "f" else np.float64)
+		self.root_id = int(root_id)
+		self.fields = dict(fields or {})
+		self._cache = {}
+
+	@classmethod
+	def from_dict(cls, jet):
+		'''
+		JetTree from a jet dictionary. Derived values stored in the dictionary (e.g. the parent, depth, tree_ancestors
+		and linkage_list of a reclustered jet) are kept as fields.
+		'''
+		fields = {key: value for key, value in jet.items() if key not in ("tree", "content", "root_id")}
+
+		return cls(jet["tree"], jet["content"], root_id=jet["root_id"], fields=fields)
+
+	def to_dict(self):
+		'''
+		Legacy jet dictionary (the arrays are shared)
+		'''
+		jet = {"root_id": self.root_id, "tree": self.tree, "content": self.content}
+		jet.update(self.fields)
+
+		return jet
+
+	def __reduce__(self):
+		return (JetTree, (self.tree, self.content, self.root_id, self.fields))
+
+	def __repr__(self):
+		return "JetTree(%s, %d leaves, %d nodes)" % (self.fields.get("name"), len(self.leaves), len(self.tree))
+
+	def _cached(self, key, build):
+		if key not in self._cache:
+			self._cache[key] = build()
+
+		return self._cache[key]
+
+	# Derived fields
+
+	@property
+	def traversal(self):
+		'''
+		preorder, leaves, parent, depth, children (see traversal.traverse). Shared, so do not modify them.
+		'''
+		return self._cached("traversal", lambda: traversal.traverse(self.tree, self.root_id))
+
+	@property
+	def preorder(self):
+		return self.traversal[0]
+
+	@property
+	def leaves(self):
+		'''
+		Leaves node ids in the order in which they are accessed when traversing the tree
+		'''
+		return self.traversal[1]
+
+	@property
+	def parent(self):
+		return self.traversal[2]
+
+	@property
+	def depth(self):
+		return self.traversal[3]
+
+	@property
+	def lca_index(self):
+		return self._cached("lca_index", lambda: traversal.LCAIndex(self.tree, self.root_id))
+
+	@property
+	def linkage(self):
+		if "linkage_list" in self.fields:
+			return self.fields["linkage_list"]
+
+		from scripts import linkageList
+		return self._cached("linkage", lambda: linkageList.truth_linkage(self))
+
+	def _derived(self, key):
+		if key in ("parent", "depth"):
+			return getattr(self, key)
+
+		if key == "linkage_list":
+			return self.linkage
+
+		if key == "tree_ancestors":
+			return self._cached(key, lambda: traversal.TreeAncestors(self.parent, self.leaves))
+
+		if key == "outers_list":
+			return self._cached(key, lambda: list(self.content[self.leaves]))
+
+		if key == "outers_node_id":
+			return self._cached(key, lambda: self.leaves.tolist())
+
+		# Dictionary {parent:[children]}, in the order in which the inner nodes are accessed
+		return self._cached(key, lambda: {node: self.tree[node] for node in self.preorder[self.tree[self.preorder, 0] != -1].tolist()})
+
+	# Dictionary interface
+
+	def __getitem__(self, key):
+		if key in ("tree", "content", "root_id"):
+			return getattr(self, key)
+
+		if key in self.fields:
+			return self.fields[key]
+
+		if key in self.derived_keys:
+			return self._derived(key)
+
+		raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		if key in ("tree", "content", "root_id"):
+			JetTree.__init__(self, value if key == "tree" else self.tree,
+			                 value if key == "content" else self.content,
+			                 value if key == "root_id" else self.root_id,
+			                 self.fields)
+		else:
+			self.fields[key] = value
+
+	def __contains__(self, key):
+		return key in ("tree", "content", "root_id") or key in self.fields or key in self.derived_keys
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.keys())
+
+	def keys(self):
+		'''
+		Stored keys (the derived fields are not included)
+		'''
+		return ["root_id", "tree", "content"] + list(self.fields)
+
+	def items(self):
+		return [(key, self[key]) for key in self.keys()]
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+	def copy(self):
+		'''
+		Shallow copy: the arrays and the cached values are shared, the fields and cache dictionaries are copied
+		'''
+		jet = JetTree.__new__(JetTree)
+		jet.tree, jet.content, jet.root_id = self.tree, self.content, self.root_id
+		jet.fields = dict(self.fields)
+		jet._cache = dict(self._cache)
+
+		return jet
@@ -4,7 +4,9 @@ import logging
 import pickle
 import logging
 
-from scripts.utils import get_logger
+from scripts import traversal
+from scripts import jetTree
+from scripts.utils import get_logger, get_diagnostics
 
 logger = get_logger(level=logging.INFO)
 
@@ -21,81 +23,75 @@ def draw_truth(in_jet):
 	[SciPy linkage list website](https://docs.scipy.org/doc/scipy/reference/generated/scipy.cluster.hierarchy.linkage.html)
 	Linkage list format: A  (n - 1) by 4 matrix Z is returned. At the i-th iteration, clusters with indices Z[i, 0] and Z[i, 1] are combined to form cluster (n + 1) . A cluster with an index less than n  corresponds to one of the n original observations. The distance between clusters Z[i, 0] and Z[i, 1] is given by Z[i, 2]. The fourth value Z[i, 3] represents the number of original observations in the newly formed cluster.
 
+	The linkage list is built in a single pass by truth_linkage.
+
 	Args:
 	- input jet dictionary.
 	"""
 
 	runTraverse_jet(in_jet, draw_tree=True)
 
-	outers_node_id = in_jet["outers_node_id"]
-
-	N = outers_node_id[-1]
-	Nleaves = len(outers_node_id)
+	# The linkage list of a jetTree.JetTree is a derived field, computed on demand
+	if not isinstance(in_jet, jetTree.JetTree):
+		in_jet["linkage_list"] = truth_linkage(in_jet)
 
-	const_list = np.arange(Nleaves)
-	temp_outers_node_id = outers_node_id
-	idx = np.asarray(outers_node_id)
-	temp = []
+	trace = get_diagnostics()
+	if trace is not None:
+		trace.record("truth_linkage", name=in_jet.get("name"), Nleaves=len(in_jet["outers_node_id"]), Nmerges=len(in_jet["linkage_list"]))
 
-	sibling_pairs = np.asarray(list(in_jet["parent_child"].values()))[::-1] # All sibling pairs node idxs
-	logger.debug(f"sibling_pairs = {sibling_pairs}")
 
-	N_leaves_list = np.ones((Nleaves)) # List that given a node idx, stores for that idx, the number of leaves for the branch below that node.
-	linkage_list = [] # linkage list to build heat clustermap visualizations.
-	waitlist = {}
-	j = 0
-	m = 0
 
-	# Start from the last leaf and build the linkage list going backwards
-	for i in range(N, 0, -1):
-		m += 1
-		node_loc = np.where(sibling_pairs == i) # Get location of node in sibling_pairs list
-		sibling = sibling_pairs[node_loc[0], 1 - node_loc[1]] # Get sibling node idx
 
-		logger.debug(f"Location of node in sibling_pairs list = {node_loc}")
-		logger.debug(f"sibling = {sibling}")
 
-		node_pos = None
-		if i in temp_outers_node_id:
-			node_pos = np.where(idx == i)[0][0] # This will give the position of i in const_list
-			temp_outers_node_id = np.delete(temp_outers_node_id, node_pos) # If i is the idx of a leaf, then delete i from list of leaves
 
-		else:
-			const_list = np.append(const_list, Nleaves + j) # Append i as an inner node to the const list
-			node_pos = Nleaves + j
-			j += 1
+def truth_linkage(jet):
+	"""
+	Linkage list of the tree of a jet dictionary ("tree", "root_id"), in O(N).
 
+	Nodes are labeled by their position in preorder (which is the truth jet node id), and visited from the last one to
+	the root's children, with a counter m that is the distance of the linkage list. Leaves are clusters 0,...,n-1 in
+	the order in which they are accessed when traversing the tree, and each inner node is the cluster formed by the row
+	of its children. The rows are built bottom-up in a single pass over the inner nodes (from the last one in preorder
+	to the root), with the same convention as the top down approach used before:
+	- if the left child is a leaf, the row is added when visiting the right child, as [min, max] of the children clusters.
+	- otherwise it is added when visiting the left child (the right one was visited before), as [max, min].
 
-		if node_pos != None:
+	Args:
+	- jet: jet dictionary
 
-			# If the sibling is a leaf
-			if sibling[0] in temp_outers_node_id:
+	Returns:
+	  (n - 1) by 4 linkage list array
+	"""
 
-				sibling_pos = np.where(idx == sibling[0]) #Find sibling position in outers list
-				N_leaves_list = np.append(N_leaves_list, N_leaves_list[node_pos] + N_leaves_list[sibling_pos[0]])
+	preorder, leaves, parent, depth, children = traversal.traverse_jet(jet)
 
-				linkage_list.append([np.minimum(const_list[node_pos], const_list[sibling_pos[0]][0]),
-				                     np.maximum(const_list[node_pos], const_list[sibling_pos[0]][0]), m,
-				                     N_leaves_list[-1]])
+	N = len(preorder) - 1 # Position of the last node
+	Nleaves = len(leaves)
+	is_leaf = children[:, 0] == -1
 
-			# If sibling is an inner node that was stored in waitlist
-			elif sibling[0] in waitlist.keys():
-				N_leaves_list = np.append(N_leaves_list, N_leaves_list[node_pos] + N_leaves_list[waitlist[sibling[0]]])
+	# Inner nodes from the last one in preorder to the root. Row k of the linkage list forms the cluster Nleaves + k.
+	inner = np.flatnonzero(~is_leaf)[::-1]
 
-				linkage_list.append([np.maximum(const_list[node_pos], const_list[waitlist[sibling[0]]]),
-				                     np.minimum(const_list[node_pos], const_list[waitlist[sibling[0]]]), m,
-				                     N_leaves_list[-1]])
+	cluster = np.zeros(len(preorder), dtype=np.int64)
+	cluster[is_leaf] = np.arange(Nleaves)
+	cluster[inner] = Nleaves + np.arange(len(inner))
 
-			# If we do not have the sibling yet, we store the node in waitlist.
-			else:
-				waitlist[i] = node_pos
+	left, right = children[inner, 0], children[inner, 1]
+	left_leaf = is_leaf[left]
 
+	low = np.minimum(cluster[left], cluster[right])
+	high = np.maximum(cluster[left], cluster[right])
 
-		logger.debug(f"linkage_list = {linkage_list}")
-		logger.debug(f"waitlist = {waitlist}")
+	# Number of leaves below each node
+	leaf_start, N_leaves_list = traversal.subtree_leaves(children)
 
+	linkage_list = np.zeros((len(inner), 4))
+	linkage_list[:, 0] = np.where(left_leaf, low, high)
+	linkage_list[:, 1] = np.where(left_leaf, high, low)
+	linkage_list[:, 2] = N + 1 - np.where(left_leaf, right, left)
+	linkage_list[:, 3] = N_leaves_list[inner]
 
-	in_jet["linkage_list"] = np.asarray(linkage_list)
+	return linkage_list
 
 
 
@@ -107,7 +103,8 @@ def draw_truth(in_jet):
 def runTraverse_jet(in_jet, parent=-1, node_id=0, dendrogram=True,
                     ancestors=[], tree_ancestors=[], draw_tree=False):
 	'''
-	Runs the traverse_jet function.
+	Traverse the jet tree and add the traversal outputs to the jet dictionary: "outers_list", "tree_ancestors" and the
+	compact "parent" and "depth" int32 arrays (tree_ancestors is a lazy view built from them, see traversal.TreeAncestors).
 
 	Args:
 	- in_jet: input jet dictionary.
@@ -119,32 +116,33 @@ def runTraverse_jet(in_jet, parent=-1, node_id=0, dendrogram=True,
 
 	'''
 
-	parent_child_dic = {}
-	tree_ancestors = []
-	outers_list = []
-	outers_node_id = []
+	# The traversal outputs of a jetTree.JetTree are derived fields, computed on demand
+	if isinstance(in_jet, jetTree.JetTree):
+		return
 
 	node_id = in_jet['root_id']
 
-	outers_list, tree_ancestors, parent_child, outers_node_id = traverse_jet(
-		in_jet,
-		parent=parent,
-		node_id=node_id,
-		outers_list=outers_list,
-		dendrogram=dendrogram,
-		ancestors=ancestors,
-		tree_ancestors=tree_ancestors,
-		parent_child_dic=parent_child_dic,
-		outers_node_id=outers_node_id,
-	)
+	preorder, leaves, parent_list, depth, children = traversal.traverse(in_jet["tree"], node_id)
+
+	in_jet["outers_list"] = list(in_jet["content"][leaves])
 
+	# Compact tree structure. tree_ancestors is a lazy view built from the parent array.
+	in_jet["parent"] = parent_list
+	in_jet["depth"] = depth
+
+	tree_ancestors = []
+	if dendrogram and len(ancestors) == 0:
+		tree_ancestors = traversal.TreeAncestors(parent_list, leaves)
+	elif dendrogram:
+		prefix = np.asarray(ancestors, dtype=np.float64)
+		tree_ancestors = [np.concatenate((prefix, entry)) for entry in traversal.ancestors(parent_list, leaves)]
 
-	in_jet["outers_list"] = outers_list
 	in_jet["tree_ancestors"] = tree_ancestors
 
 	if draw_tree:
-		in_jet["parent_child"] = parent_child
-		in_jet["outers_node_id"] = outers_node_id
+		# Dictionary {parent:[children]}, in the order in which the inner nodes are accessed
+		in_jet["parent_child"] = {inner: in_jet["tree"][inner] for inner in preorder[children[:, 0] != -1].tolist()}
+		in_jet["outers_node_id"] = leaves.tolist()
 
 
 
@@ -163,7 +161,7 @@ def traverse_jet(
 		outers_node_id = None,
 ):
 	'''
-	Recursive function to traverse the tree and get a list of the leaves
+	Traverse the tree (without recursion, see traversal.traverse) and get a list of the leaves
 	Args:
 		jet: jet dictionary
 		node_id: id of the current node
@@ -177,45 +175,20 @@ def traverse_jet(
 		outers_list, tree_ancestors, parent_child_dic, outers_node_id
 	'''
 
-	new_ancestors = None
-	if dendrogram:
-		new_ancestors = np.copy(ancestors)
-		new_ancestors = np.append(new_ancestors, node_id)  # Node idxs in the truth jet dictionary
-
-	# Build outers list
-	if jet["tree"][node_id, 0] == -1:
-		outers_list.append(jet["content"][node_id])
-		outers_node_id.append(node_id)
-
-		if dendrogram:
-			tree_ancestors.append(new_ancestors)
-
-	else:
-		# Add {parent:[children]} to dic
-		parent_child_dic[node_id] = jet["tree"][node_id]
-
-		traverse_jet(
-			jet,
-			node_id,
-			jet["tree"][node_id, 0],
-			outers_list,
-			ancestors=new_ancestors,
-			dendrogram=dendrogram,
-			tree_ancestors=tree_ancestors,
-			parent_child_dic=parent_child_dic,
-			outers_node_id=outers_node_id,
-		)
+	preorder, leaves, parent_list, depth, children = traversal.traverse(jet["tree"], node_id)
 
-		traverse_jet(
-			jet,
-			node_id,
-			jet["tree"][node_id, 1],
-			outers_list,
-			ancestors=new_ancestors,
-			dendrogram=dendrogram,
-			tree_ancestors=tree_ancestors,
-			parent_child_dic=parent_child_dic,
-			outers_node_id=outers_node_id,
+	outers_list.extend(jet["content"][leaves])
+	outers_node_id.extend(leaves.tolist())
+
+	# Add {parent:[children]} to dic, in the order in which the inner nodes are accessed
+	for inner in preorder[jet["tree"][preorder, 0] != -1].tolist():
+		parent_child_dic[inner] = jet["tree"][inner]
+
+	if dendrogram:
+		# Node idxs in the truth jet dictionary
+		prefix = np.asarray(ancestors if ancestors is not None else [], dtype=np.float64)
+		tree_ancestors.extend(
+			[np.concatenate((prefix, entry)) for entry in traversal.ancestors(parent_list, leaves)]
 		)
 
-	return outers_list, tree_ancestors, parent_child_dic, outers_node_id
\ No newline at end of file
+	return outers_list, tree_ancestors, parent_child_dic, outers_node_id
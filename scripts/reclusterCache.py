@@ -0,0 +1,189 @@
+import os
+import pickle
+import hashlib
+import tempfile
+import logging
+import numpy as np
+from collections import OrderedDict
+
+from scripts import reclusterTree
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+
+
+class ReclusterCache(object):
+  """
+  Memoization layer around reclusterTree.recluster. Reclustered jets are keyed by a hash of the ordered leaves momenta
+  of the input jet, the value of alpha and the clustering method, so the same jet (e.g. a truth jet and the jets
+  reclustered from it, that have the same leaves in the same order) is only clustered once per algorithm.
+
+  - In memory, the jets are kept in a LRU with at most maxsize entries.
+  - If cache_dir is given, the jets are also saved there as pickle files ({key}.pkl), and loaded from there when they
+    are not in memory (e.g. after restarting a notebook). Files are written to a temporary file and renamed, so several
+    processes can share the same cache_dir.
+
+  A shallow copy of the cached jet is returned, so adding or replacing keys of the output does not change the cache.
+  The arrays are shared, so they should not be modified in place.
+
+  Args:
+  - maxsize: max number of jets kept in memory.
+  - cache_dir: (optional) dir for the on-disk store.
+  """
+
+  def __init__(self, maxsize=128, cache_dir=None):
+    self.maxsize = maxsize
+    self.cache_dir = cache_dir
+    self._jets = OrderedDict()
+
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+
+    if cache_dir:
+      os.makedirs(cache_dir, exist_ok=True)
+
+  def key(self, jet_const, alpha=None, method="matrix"):
+    """
+    Hash of the ordered leaves momenta, alpha and the clustering method
+    """
+    jet_const = np.ascontiguousarray(jet_const)
+
+    sha = hashlib.sha1()
+    sha.update(str((jet_const.dtype.str, jet_const.shape, alpha, method)).encode())
+    sha.update(jet_const.tobytes())
+
+    return sha.hexdigest()
+
+  def recluster(self, input_jet, alpha=None, method="matrix"):
+    """
+    Same as reclusterTree.recluster(input_jet, alpha=alpha, save=False, method=method), but only clustering the jet
+    the first time.
+    """
+    key = self.key(reclusterTree.getConstituents(input_jet), alpha=alpha, method=method)
+
+    if key in self._jets:
+      self.hits += 1
+      self._jets.move_to_end(key)
+      return dict(self._jets[key])
+
+    jet = self._load(key)
+    if jet is not None:
+      self.disk_hits += 1
+
+    else:
+      self.misses += 1
+      jet = reclusterTree.recluster(input_jet, alpha=alpha, save=False, method=method)
+      self._dump(key, jet)
+
+    self._store(key, jet)
+
+    return dict(jet)
+
+  def _store(self, key, jet):
+    self._jets[key] = jet
+    self._jets.move_to_end(key)
+
+    while len(self._jets) > self.maxsize:
+      self._jets.popitem(last=False)
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, key + ".pkl")
+
+  def _load(self, key):
+    if not self.cache_dir or not os.path.isfile(self._path(key)):
+      return None
+
+    try:
+      with open(self._path(key), "rb") as f:
+        return pickle.load(f)
+
+    # An unreadable file (e.g. truncated by a full disk) is a miss, and it is removed so the jet is saved again.
+    # Corrupt pickles can raise many exception types (EOFError, UnpicklingError, AttributeError, ValueError, ...)
+    except Exception as error:
+      logger.warning(f"Removing unreadable cache file {self._path(key)}: {error!r}")
+      try:
+        os.remove(self._path(key))
+      except FileNotFoundError:
+        pass
+
+      return None
+
+  def _dump(self, key, jet):
+    if not self.cache_dir:
+      return
+
+    # Write to a temporary file in the same dir and rename it, so that a crash or another process writing the same key
+    # (e.g. recluster_many workers) never leaves a partial {key}.pkl
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=key, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        pickle.dump(jet, f, protocol=2)
+      os.replace(tmp_path, self._path(key))
+
+    except BaseException:
+      os.remove(tmp_path)
+      raise
+
+  def clear(self, disk=False):
+    """
+    Empty the in-memory LRU (and the on-disk store if disk=True), and reset the counters.
+    """
+    self._jets.clear()
+    self.hits = self.disk_hits = self.misses = 0
+
+    if disk and self.cache_dir:
+      for file in os.listdir(self.cache_dir):
+        if file.endswith(".pkl"):
+          os.remove(os.path.join(self.cache_dir, file))
+
+  def info(self):
+    """
+    Dictionary with the hit and miss counters and the number of jets in memory
+    """
+    return {"hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self._jets),
+            "maxsize": self.maxsize,
+            "cache_dir": self.cache_dir}
+
+  def __len__(self):
+    return len(self._jets)
+
+  def __repr__(self):
+    return "ReclusterCache(hits=%d, disk_hits=%d, misses=%d, size=%d/%d)" % (
+      self.hits, self.disk_hits, self.misses, len(self._jets), self.maxsize)
+
+
+
+
+
+
+# Default cache shared by the visualization functions
+_cache = ReclusterCache()
+
+
+def get_cache():
+  """
+  Default cache used by heatClustermap and Tree1D
+  """
+  return _cache
+
+
+def set_cache(maxsize=128, cache_dir=None):
+  """
+  Replace the default cache, e.g. to add an on-disk store: set_cache(cache_dir="data/recluster_cache")
+  """
+  global _cache
+  _cache = ReclusterCache(maxsize=maxsize, cache_dir=cache_dir)
+
+  return _cache
+
+
+def recluster(input_jet, alpha=None, method="matrix"):
+  """
+  Recluster a jet with the default cache (see ReclusterCache.recluster). The reclustered jet is not saved.
+  """
+  return _cache.recluster(input_jet, alpha=alpha, method=method)
@@ -3,14 +3,19 @@ import numpy as np
 import logging
 import pickle
 import itertools
+import heapq
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-from scripts.utils import get_logger
+from scripts import traversal
+from scripts.utils import get_logger, get_diagnostics
 
 logger = get_logger(level=logging.INFO)
 
 
 
-def recluster(input_jet, alpha=None, save=True):
+def recluster(input_jet, alpha=None, save=True, method="matrix", store=None):
   """
   Uses helper functions to get the leaves of an  input jet, recluster them following some algorithm determined by the value of alpha,
    create the new tree for the chosen algorithm, make a jet dictionary and save it.
@@ -24,7 +29,10 @@ def recluster(input_jet, alpha=None, save=True):
 
   New features added to the tree:
   - jet["tree_ancestors"]: List with one entry for each leaf of the tree, where each entry lists all the ancestor node ids
-    when traversing the tree from the root to the leaf node.
+    when traversing the tree from the root to the leaf node. This is a lazy view (traversal.TreeAncestors) built from
+    jet["parent"], use list(jet["tree_ancestors"]) to get the full list of arrays.
+  - jet["parent"]: int32 array with the parent node id of each node (-1 for the root).
+  - jet["depth"]: int32 array with the number of steps from the root to each node.
   - jet["linkage_list"]: linkage list to build heat clustermap visualizations.
   - jet["Nconst"]: Number of leaves of the tree.
   - jet["algorithm"]: Algorithm to generate the tree structure, e.g. truth, kt, antikt, CA.
@@ -33,65 +41,117 @@ def recluster(input_jet, alpha=None, save=True):
   - input_jet: any jet dictionary with the clustering history.
   - alpha: defines the clustering algorithm. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
   - save: if true, save the reclustered jet dictionary
+  - store: (optional) jetStore.JetStoreWriter. If given, the saved jet is appended to it instead of a pickle file
+    in data/.
+  - method: clustering engine, one of the keys of clustering_methods (exact) or approximate_methods.
+    "matrix" (default) keeps an N x N matrix of angles in NumPy and the nearest neighbour of each pseudojet (O(N^2)),
+    "bruteforce" recomputes all the pairs at each level with dijMinPair. Both give the same tree.
+    "nn_approx" is approximate: it keeps the pseudojets in a ring sorted by angle and only considers neighbours in the
+    ring (O(N log N)), see ktAntiktCANN. That is only exact when d_ij is a function of the angle, which fails for soft
+    pseudojets, as the epsilon=1e-6 in the cosine denominator is not negligible when |pi|*|pj| is of order 1 or below.
+    Jets with soft constituents then often get a different tree (e.g. 15 of 60 trees of generated jets with 60
+    constituents).
 
   Returns:
     jet dictionary
   """
 
 
-  def _rec(jet, parent, node_id, outers_list):
-    """
-    Recursive function to get a list of the tree leaves
-    """
-    if jet["tree"][node_id, 0] == -1:
+  # Get constituents list (leaves)
+  jet_const = getConstituents(input_jet)
+
+  # Run the kt, CA or antikt clustering algorithms
+  jet = _makeJet(_clusteringMethod(method)(jet_const, alpha=alpha), alpha)
+
+  # Save reclustered tree
+  if save:
+    _saveJet(jet, input_jet["name"], alpha, store=store)
+
+  return jet
+
+
+
+
+
+
+def recluster_multi(input_jet, alphas=(-1, 0, 1), save=True, method="matrix", store=None):
+  """
+  Recluster a jet with several algorithms (values of alpha) in a single pass. The constituents are extracted once and,
+  for the matrix method, the pairwise angles between them are computed once and shared by all the algorithms, as only
+  the min(pTi^(2\alpha),pTj^(2\alpha)) factor of d_ij depends on alpha.
+
+  Args:
+  - input_jet: any jet dictionary with the clustering history.
+  - alphas: values of alpha, e.g. (-1, 0, 1) for {anti-kt, CA, kt}, or any grid of values.
+  - save: if true, save the reclustered jet dictionaries
+  - store: (optional) jetStore.JetStoreWriter. If given, the saved jets are appended to it instead of pickle files.
+  - method: clustering engine (see recluster).
+
+  Returns:
+    dictionary {alpha: reclustered jet dictionary}
+  """
+
+  jet_const = getConstituents(input_jet)
 
-      outers_list.append(jet["content"][node_id])
+  angles = None
+  if method == "matrix":
+    angles = angleMatrix(jet_const)
 
+  jets = {}
+  for alpha in alphas:
+
+    if method == "matrix":
+      clustering = ktAntiktCAMatrix(jet_const, alpha=alpha, angles=angles)
     else:
-      _rec(
-        jet,
-        node_id,
-        jet["tree"][node_id, 0],
-        outers_list,
-      )
+      clustering = _clusteringMethod(method)(jet_const, alpha=alpha)
 
-      _rec(
-        jet,
-        node_id,
-        jet["tree"][node_id, 1],
-        outers_list,
-      )
+    jets[alpha] = _makeJet(clustering, alpha)
 
-    return outers_list
+    if save:
+      _saveJet(jets[alpha], input_jet["name"], alpha, store=store)
 
+  return jets
 
-  outers = []
 
-  # Get constituents list (leaves)
-  jet_const = np.asarray(
-    _rec(
-    input_jet,
-    -1,
-    input_jet["root_id"],
-    outers,
-  )
-  )
 
-  # Run the kt, CA or antikt clustering algorithms
+
+
+
+def getConstituents(jet):
+  """
+  Get the list of the tree leaves momentum, in the order in which they are accessed when traversing the tree.
+  """
+
+  preorder, leaves, parent, depth, children = traversal.traverse_jet(jet)
+
+  return np.asarray(jet["content"])[leaves]
+
+
+
+
+
+
+def _makeJet(clustering, alpha):
+  """
+  Build the reclustered tree and the jet dictionary with tree features, from the outputs of a clustering method
+  (see ktAntiktCA)
+  """
   raw_tree, \
   idx, \
   jet_content, \
   root_node, \
   Nconst, \
   N_leaves_list, \
-  linkage_list = ktAntiktCA(jet_const, alpha=alpha)
+  linkage_list = clustering
 
 
   # Build the reclustered tree
   tree, \
   content, \
   node_id, \
-  tree_ancestors = _traverse(root_node,
+  tree_ancestors, \
+  parent, \
+  depth = _traverse(root_node,
                              jet_content,
                              tree_dic=raw_tree,
                              Nleaves=Nconst,
@@ -102,27 +162,134 @@ def recluster(input_jet, alpha=None, save=True):
   jet = {}
   jet["root_id"] = 0
   jet["tree"] = np.asarray(tree).reshape(-1, 2)
-  jet["content"] = np.asarray([np.asarray(c) for c in content]).reshape(-1, 2)
+  jet["content"] = np.asarray(content).reshape(-1, 2)
   jet["linkage_list"]=linkage_list
   jet["node_id"]=node_id
   jet["tree_ancestors"]=tree_ancestors
+  jet["parent"]=parent
+  jet["depth"]=depth
   jet["Nconst"]=Nconst
   jet["algorithm"]=alpha
 
+  return jet
 
-  # Save reclustered tree
-  if save:
-    out_dir = "data/"
-    # print("input_jet[name]=",input_jet["name"])
 
-    algo = str(input_jet["name"]) + '_' + str(alpha)
-    out_filename = out_dir + str(algo) + '.pkl'
-    logger.info(f"Output jet filename = {out_filename}")
-    with open(out_filename, "wb") as f:
-      pickle.dump(jet, f, protocol=2)
 
 
-  return jet
+
+
+def _saveJet(jet, name, alpha, store=None):
+  """
+  Save reclustered tree, as a pickle file or in a jet store (see jetStore.JetStoreWriter)
+  """
+  if store is not None:
+    store.append(jet, name=name, algorithm=alpha)
+    return
+
+  out_dir = "data/"
+
+  algo = str(name) + '_' + str(alpha)
+  out_filename = out_dir + str(algo) + '.pkl'
+  logger.info(f"Output jet filename = {out_filename}")
+  with open(out_filename, "wb") as f:
+    pickle.dump(jet, f, protocol=2)
+
+
+
+
+
+
+def recluster_many(jets, alphas=(-1, 0, 1), n_jobs=None, chunksize=None, method="matrix"):
+  """
+  Recluster a list of jets with each of the algorithms in alphas, splitting the jets in chunks over a process pool.
+  The reclustered jets are not saved.
+
+  Args:
+  - jets: list (or iterable) of jet dictionaries.
+  - alphas: values of alpha to recluster each jet. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
+  - n_jobs: number of worker processes. If None, use all the cores. If 1, run in the current process.
+  - chunksize: number of jets sent to a worker at a time. If None, split the jets in ~4 chunks per worker.
+  - method: clustering engine (see recluster).
+
+  Returns:
+    list with one entry for each input jet, in the same order. Each entry is a dictionary {alpha: reclustered jet}, or
+    the exception raised when reclustering that jet (a failure does not stop the other jets).
+  """
+
+  jets = list(jets)
+  n_jobs = n_jobs or os.cpu_count() or 1
+  if chunksize is None:
+    chunksize = max(1, len(jets) // (4 * n_jobs))
+
+  tasks = [(jet, tuple(alphas), method) for jet in jets]
+
+  if n_jobs == 1 or len(jets) <= 1:
+    results = list(map(_recluster_worker, tasks))
+
+  else:
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+      results = list(executor.map(_recluster_worker, tasks, chunksize=chunksize))
+
+  for i, result in enumerate(results):
+    if isinstance(result, Exception):
+      logger.warning(f"Reclustering failed for jet {i}: {result!r}")
+
+  return results
+
+
+
+
+
+
+def _recluster_worker(task):
+  """
+  Recluster one jet for recluster_many. Exceptions are returned instead of raised, so that they come back for each jet.
+  """
+  jet, alphas, method = task
+
+  try:
+    return recluster_multi(jet, alphas=alphas, save=False, method=method)
+
+  except Exception as error:
+    return error
+
+
+
+
+
+
+def compare_methods(jets, alphas=(-1, 0, 1), methods=("matrix",), reference="bruteforce"):
+  """
+  Check the clustering engines against a reference one: recluster each jet with each method and each algorithm and
+  compare the trees (tree structure and order of the leaves). The exact engines (clustering_methods) should have no
+  differences. Approximate engines (approximate_methods) can also be given, to count how often they differ.
+
+  Args:
+  - jets: list (or iterable) of jet dictionaries.
+  - alphas: values of alpha. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
+  - methods: clustering engines to check (keys of clustering_methods or approximate_methods).
+  - reference: clustering engine used as reference.
+
+  Returns:
+    dictionary {method: list of (jet name, alpha) with a different tree than the reference}
+  """
+
+  mismatches = {method: [] for method in methods}
+
+  for i, jet in enumerate(jets):
+    name = jet.get("name", i)
+    reference_jets = recluster_multi(jet, alphas=alphas, save=False, method=reference)
+
+    for method in methods:
+      method_jets = recluster_multi(jet, alphas=alphas, save=False, method=method)
+
+      for alpha in alphas:
+        same_tree = np.array_equal(reference_jets[alpha]["tree"], method_jets[alpha]["tree"]) and \
+                    list(reference_jets[alpha]["node_id"]) == list(method_jets[alpha]["node_id"])
+        if not same_tree:
+          mismatches[method].append((name, alpha))
+
+  return mismatches
 
 
 
@@ -134,59 +301,41 @@ def ktAntiktCA(const_list, alpha=None):
   Runs the dijMinPair function level by level starting from the list of constituents (leaves) until we reach the root of the tree.
   Note: - We refer to both leaves and inner nodes as pseudojets.
 
+  The clustering state is kept in buffers allocated once (see _clusteringBuffers), that dijMinPair updates in place.
+
   Args:
       - const_list: jet constituents (i.e. the leaves of the tree)
       - alpha: defines the clustering algorithm. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
 
   Returns:
-      Note:
-         Const_list: nodes list after deleting the constituents that are merged and adding the new pseudojet in each level.
-          So this should only have the root of the tree at the end.
-
       - tree_dic: dictionary that has the node id of a parent as a key and a list with the id of the 2 children as the values
       - idx: array that stores the node id
        (the node id determines the location of the momentum vector of a pseudojet in the jet_content array)
-        of the pseudojets that are in the current const_list array. It has the same elements as the const_list (they get updated
-        level by level).
+        of the pseudojets that are left after the last level. So this should only have the root of the tree.
       - jet_content: array with the momentum of all the nodes of the jet tree (both leaves and inners).
       - root_node: root node id
       - Nconst: Number of leaves of the jet
-      - N_leaves_list: List that given a node idx, stores for that idx, the number of leaves for the branch below that node.
-      - linkage_list: linkage list to build heat clustermap visualizations.
+      - N_leaves_list: array that given a node idx, stores for that idx, the number of leaves for the branch below that node.
+      - linkage_list: (Nconst-1) x 4 linkage array to build heat clustermap visualizations.
   """
 
+  const_list = np.asarray(const_list).reshape(-1, 2)
   Nconst = len(const_list)
 
   root_node = 2 * Nconst - 2
   logger.debug(f"Root node = (N constituents + N parent) = {root_node}")
 
-  idx = np.arange(Nconst)
-
-  # List that given a node idx, stores for that idx, the number of leaves for the branch below that node.
-  # It is initialized only with the tree leaves
-  N_leaves_list = np.ones((Nconst))
+  jet_content, N_leaves_list, active, linkage_list = _clusteringBuffers(const_list)
 
-
-  linkage_list = []
-
-  dij_hist = []
+  dij_hist = np.zeros(max(Nconst - 1, 0))
   tree_dic = {}
-  const_list = np.asarray(const_list)
-  jet_content = const_list
-
-  for j in range(len(const_list) - 1):
-    const_list, \
-    dij_hist, \
-    tree_dic, \
-    idx, \
-    jet_content, \
-    N_leaves_list, \
-    linkage_list = dijMinPair(
-      const_list,
+
+  for j in range(Nconst - 1):
+    dijMinPair(
+      jet_content,
+      active,
       dij_hist,
       tree_dic,
-      jet_content,
-      idx,
       alpha=alpha,
       Nconst=Nconst,
       Nparent=j,
@@ -194,6 +343,8 @@ def ktAntiktCA(const_list, alpha=None):
       linkage_list=linkage_list,
     )
 
+  idx = np.flatnonzero(active)
+
   return tree_dic, idx, jet_content, root_node, Nconst, N_leaves_list, linkage_list
 
 
@@ -201,13 +352,42 @@ def ktAntiktCA(const_list, alpha=None):
 
 
 
+def _clusteringBuffers(const_list):
+  """
+  Allocate the buffers with the clustering state, with the size for the full tree (2 Nconst - 1 nodes):
+  - jet_content: momentum of all the nodes of the tree. The leaves are the first Nconst entries and the pseudojet
+    created at level j is stored at Nconst + j.
+  - N_leaves_list: number of leaves for the branch below each node.
+  - active: mask with the pseudojets that have not been merged yet.
+  - linkage_list: (Nconst-1) x 4 linkage array.
+  The momentum precision of the input jet is kept (the toy model jets are float32).
+  """
+  Nconst = len(const_list)
+  Nnodes = max(2 * Nconst - 1, 0)
+
+  jet_content = np.zeros((Nnodes, 2), dtype=np.result_type(const_list.dtype, np.float32))
+  jet_content[:Nconst] = const_list
+
+  N_leaves_list = np.zeros(Nnodes)
+  N_leaves_list[:Nconst] = 1
+
+  active = np.zeros(Nnodes, dtype=bool)
+  active[:Nconst] = True
+
+  linkage_list = np.zeros((max(Nconst - 1, 0), 4))
+
+  return jet_content, N_leaves_list, active, linkage_list
+
+
+
+
+
 
 def dijMinPair(
-    const_list,
+    jet_content,
+    active,
     var_dij_history,
     tree_dic,
-    jet_content,
-    idx,
     alpha=None,
     Nconst=None,
     Nparent=None,
@@ -216,108 +396,436 @@ def dijMinPair(
 ):
     """
     -Calculate all d_ij distance (from the generalized kt jet clustering algorithms) between all possible pair of constituents at a certain level and get the minimum.
-    -Update the constituents list by deleting the constituents that are merged and adding the new pseudojet
+    -Update the clustering state by deactivating the constituents that are merged and adding the new pseudojet
     (We refer to both leaves and inner nodes as pseudojets.)
+    All the arrays are buffers allocated once for the full tree (see _clusteringBuffers) and are updated in place.
 
     Args:
-        - const_list: array with the constituents momentum list for the current level (i.e. deleting the constituents that are merged and
-          adding the new pseudojet from merging them)
-        - var_dij_history: list with all the previous min{d_ij}
+        - jet_content: array with the momentum of all the nodes of the jet tree (both leaves and inners).
+          We add a new node at Nconst + Nparent each time we cluster 2 pseudojets
+        - active: mask with the pseudojets of the current level (i.e. without the constituents that are merged and
+          with the new pseudojets from merging them). The node id of a pseudojet determines the location of its momentum
+          in the jet_content array.
+        - var_dij_history: array with all the previous min{d_ij}
         - tree_dic: dictionary that has the node id of a parent as a key and a list with the id of the 2 children as the values
-        - jet_content: array with the momentum of all the nodes of the jet tree (both leaves and inners) after adding one
-          more level in the clustering.
-          We add a new node each time we cluster 2 pseudojets
-        - idx: array that stores the node id (the node id determines the location of the momentum of a pseudojet in the jet_content array)
-          of the pseudojets that are in the current const_list array. It has the same number of elements as the const_list (they get updated
-          level by level).
         - alpha: defines the clustering algorithm. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
         - Nconst: Number of leaves
         - Nparent: index of each parent added to the tree_dic.
-        - N_leaves_list
-        - linkage_list: linkage list to build heat clustermap visualizations.
+        - N_leaves_list: array that given a node idx, stores for that idx, the number of leaves for the branch below that node.
+        - linkage_list: linkage array to build heat clustermap visualizations.
           [SciPy linkage list website](https://docs.scipy.org/doc/scipy/reference/generated/scipy.cluster.hierarchy.linkage.html)
           Linkage list format: A  (n - 1) by 4 matrix Z is returned. At the i-th iteration, clusters with indices Z[i, 0] and Z[i, 1] are combined to form cluster (n + 1) . A cluster with an index less than n  corresponds to one of the n original observations. The distance between clusters Z[i, 0] and Z[i, 1] is given by Z[i, 2]. The fourth value Z[i, 3] represents the number of original observations in the newly formed cluster.
 
-    Returns:
-        - new_list: new const_list after deleting the constituents that are merged and adding the new pseudojet in the current level.
-        - var_dij_history
-        - tree_dic
-        - idx
-        - jet_content
-        -  N_leaves_list
-        - linkage_list
-
     """
 
+    # Diagnostics are only computed in trace mode, and debug strings only formatted at the DEBUG level
+    trace = get_diagnostics()
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    # Node ids and momentum of the pseudojets in the current level
+    idx = np.flatnonzero(active)
+    const_list = jet_content[idx]
+
     # Get all possible pairings
     pairs = np.asarray(list(itertools.combinations(np.arange(len(const_list)), 2)))
+    pair_list = const_list[pairs]
 
-    const_list_pt = np.absolute([element[0] for element in const_list])
-    logger.debug(f"const_list_pt = {const_list_pt}")
+    const_list_pt = np.absolute(const_list[:, 0])
+    if debug:
+      logger.debug(f"const_list_pt = {const_list_pt}")
 
 
     # Get all dij at current level: dij=min(pTi^(2\alpha),pTj^(2\alpha)) * [arccos((pi.pj)/|pi|*|pj|)]^2
+    # The cosine is clipped to [-1,1], as rounding can give a value above 1 for collinear float32 pseudojets.
     epsilon=1e-6 #For numerical stability
     dij_list = [(np.sort((const_list_pt[pairs][k]) ** (2 * alpha))[0] * \
-                 (np.arccos(np.dot(const_list[pairs][k][0],const_list[pairs][k][1])/
-                            (epsilon + np.linalg.norm(const_list[pairs][k][0]) * np.linalg.norm(const_list[pairs][k][1]))\
+                 (np.arccos(np.clip(np.dot(pair_list[k][0],pair_list[k][1])/
+                            (epsilon + np.linalg.norm(pair_list[k][0]) * np.linalg.norm(pair_list[k][1])),
+                            -1., 1.)\
                             )) ** 2, k)\
-                for k in range(len(const_list[pairs]))]
-
-    logger.debug(f"dij_list = {dij_list}")
-
-    cos_arg=(np.sum([np.count_nonzero(np.absolute(np.sum(const_list[pairs][k][0] * const_list[pairs][k][1]) /
-                            (np.sqrt(np.sum(const_list[pairs][k][0] ** 2)) * np.sqrt(
-                              np.sum(const_list[pairs][k][1] ** 2))))> 1) for k in range(len(const_list[pairs]))]))
-    logger.debug(f"Cos arg > 1? = {cos_arg}")
-
-    cosines=[np.absolute(np.sum(const_list[pairs][k][0] * const_list[pairs][k][1]) /
-                            (np.sqrt(np.sum(const_list[pairs][k][0] ** 2)) * np.sqrt(
-                              np.sum(const_list[pairs][k][1] ** 2)))) for k in range(len(const_list[pairs]))]
-    logger.debug(f"pos,value = {[(i,cosines[i]) for i in range(len(cosines)) if np.absolute(cosines[i])<0.99]}")
+                for k in range(len(pair_list))]
 
+    if debug:
+      logger.debug(f"dij_list = {dij_list}")
 
 
     # Get pair index (in pairs list) with min dij
     min_tuple = sorted(dij_list, key=lambda x: x[0])[0]
     min_pair = min_tuple[1]
-    logger.debug(f"min_pair= {pairs[min_pair]}")
+    if debug:
+      logger.debug(f"min_pair= {pairs[min_pair]}")
 
+    new_node = Nconst + Nparent
+    node_i, node_j = idx[pairs[min_pair]]
 
-    # List that given a node idx, stores for that idx, the number of leaves for the branch below that node.
-    N_leaves_list = np.concatenate(
-      (N_leaves_list, [N_leaves_list[idx[pairs[min_pair][0]]] + N_leaves_list[idx[pairs[min_pair][1]]]]))
+    # Number of leaves for the branch below the new node
+    N_leaves_list[new_node] = N_leaves_list[node_i] + N_leaves_list[node_j]
 
+    # All the previous min{d_ij}
+    var_dij_history[Nparent] = min_tuple[0]
 
-    # List with all the previous min{d_ij}
-    var_dij_history.append(dij_list[min_pair])
+    linkage_list[Nparent] = [node_i, node_j, min_tuple[0], N_leaves_list[new_node]]
 
-    linkage_list.append([idx[pairs[min_pair][0]], idx[pairs[min_pair][1]], min_tuple[0], N_leaves_list[-1]])
+    if trace is not None:
+      trace.record("merge",
+                   method="bruteforce",
+                   level=Nparent,
+                   pair=(int(node_i), int(node_j)),
+                   dij=float(min_tuple[0]),
+                   cos_anomalies=_cosAnomalies(pair_list[:, 0], pair_list[:, 1]))
 
+    if debug:
+      logger.debug(f"------------------------------------------------------------")
+      logger.debug(f"const_list= {const_list}")
+      logger.debug(f"const_list[pairs[min_pair]]= {const_list[pairs[min_pair]]}")
+      logger.debug(f"np.sum(const_list[pairs[min_pair]],axis=0) = {np.sum(const_list[pairs[min_pair]],axis=0)}")
 
-    logger.debug(f"------------------------------------------------------------")
-    logger.debug(f"const_list= {const_list}")
-    logger.debug(f"const_list[pairs[min_pair]]= {const_list[pairs[min_pair]]}")
-    logger.debug(f"np.sum(const_list[pairs[min_pair]],axis=0) = {np.sum(const_list[pairs[min_pair]],axis=0)}")
-    logger.debug(f"const_list[0] = {const_list[0]}")
+    jet_content[new_node] = np.sum(const_list[pairs[min_pair]], axis=0)
 
-    new_list = np.reshape(
-      np.append(np.delete(const_list, pairs[min_pair], 0), [np.sum(const_list[pairs[min_pair]], axis=0)]), (-1, 2))
-    logger.debug(f"New list =  {new_list}")
 
-    jet_content = np.concatenate((jet_content, [np.sum(const_list[pairs[min_pair]], axis=0)]), axis=0)
+    # Add a new key to the tree dictionary
+    tree_dic[new_node] = idx[pairs[min_pair]]
+    if debug:
+      logger.debug(f"tree_dic = {tree_dic}")
+      logger.debug(f"------------------------------------------------------------")
 
+    # Deactivate the merged nodes
+    active[[node_i, node_j]] = False
+    active[new_node] = True
 
-    # Add a new key to the tree dictionary
-    tree_dic[Nconst + Nparent] = idx[pairs[min_pair]]
-    logger.debug(f"tree_dic = {tree_dic}")
-    logger.debug(f"------------------------------------------------------------")
 
-    # Delete the merged nodes
-    idx = np.concatenate((np.delete(idx, pairs[min_pair]), [Nconst + Nparent]), axis=0)
-    logger.debug(f"idx = {idx}")
 
-    return new_list, var_dij_history, tree_dic, idx, jet_content, N_leaves_list, linkage_list
+
+
+
+def _cosAnomalies(p_i, p_j):
+  """
+  Number of pairs of pseudojets (p_i[k], p_j[k]) for which |(pi.pj)/|pi|*|pj|| > 1 because of rounding (before
+  clipping the cosine for the arccos). Only used in trace mode.
+  """
+  cos = np.sum(p_i * p_j, axis=-1) / (np.linalg.norm(p_i, axis=-1) * np.linalg.norm(p_j, axis=-1))
+
+  return int(np.count_nonzero(np.absolute(cos) > 1))
+
+
+
+
+
+
+def ktAntiktCAMatrix(const_list, alpha=None, angles=None):
+  """
+  Same as ktAntiktCA but keeping an N x N matrix with the squared angles A_ij between the pseudojets of the current
+  level. When 2 pseudojets are merged, the new pseudojet takes the slot of one of them, only its row and column are
+  recomputed, and the other slot is masked with inf.
+
+  As d_ij = min(w_i, w_j) * A_ij with w_i = pTi^(2\alpha), the min d_ij over all the pairs is the min over the rows of
+  w_i * min_k A_ik (for any symmetric A, so it is exact with the epsilon in the cosine): we keep the nearest
+  neighbour in angle of each row, and after a merge only the rows whose nearest neighbour was one of the merged
+  pseudojets are recomputed. Unlike the nearest neighbour in d_ij, that only depends on the geometry (not on alpha),
+  so there are only a few of them at each level and the clustering is O(N^2) for kt, CA and anti-kt.
+
+  Ties are broken as in dijMinPair (lowest pair of node ids), so both functions give the same tree.
+
+  Args:
+      - const_list: jet constituents (i.e. the leaves of the tree)
+      - alpha: defines the clustering algorithm. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
+      - angles: (optional) matrix with the squared angles between the constituents, from angleMatrix. It does not depend
+        on alpha, so it can be shared when reclustering the same jet with different algorithms.
+
+  Returns:
+      Same outputs as ktAntiktCA: tree_dic, idx, jet_content, root_node, Nconst, N_leaves_list, linkage_list
+  """
+
+  const_list = np.asarray(const_list).reshape(-1, 2)
+  Nconst = len(const_list)
+
+  root_node = 2 * Nconst - 2
+  logger.debug(f"Root node = (N constituents + N parent) = {root_node}")
+
+  jet_content, N_leaves_list, active_node, linkage_list = _clusteringBuffers(const_list)
+  tree_dic = {}
+
+  # Node id of the pseudojet stored in each slot of the matrix
+  slot_node = np.arange(Nconst)
+  active = np.ones(Nconst, dtype=bool)
+
+  pt = np.absolute(const_list[:, 0])
+  norm = np.linalg.norm(const_list, axis=1)
+  weight = pt ** (2 * alpha)
+
+  if angles is None:
+    angles = angleMatrix(const_list, norm)
+  angles = np.array(angles, dtype=np.result_type(angles, weight))
+  np.fill_diagonal(angles, np.inf)
+
+  trace = get_diagnostics()
+
+  # Nearest neighbour in angle of each row (any of them if there are ties)
+  near = np.argmin(angles, axis=1) if Nconst > 1 else np.zeros(Nconst, dtype=int)
+  near_angle = angles[np.arange(Nconst), near]
+
+  for j in range(Nconst - 1):
+
+    # Min d_ij, and all the pairs that have it (rows with w_i * min_k A_ik = min d_ij), to take the lowest pair of
+    # node ids if there are ties
+    row_dij = weight * near_angle
+    min_dij = np.min(row_dij[active])
+    pairs = []
+    for slot in np.flatnonzero(active & (row_dij == min_dij)):
+      row = np.minimum(weight[slot], weight) * angles[slot]
+      for other in np.flatnonzero(active & (row == min_dij)):
+        pairs.append(sorted(((slot_node[slot], slot), (slot_node[other], other))))
+    (node_i, slot_i), (node_j, slot_j) = min(pairs)
+    pair = np.asarray([node_i, node_j])
+
+    new_node = Nconst + j
+    jet_content[new_node] = jet_content[node_i] + jet_content[node_j]
+    N_leaves_list[new_node] = N_leaves_list[node_i] + N_leaves_list[node_j]
+
+    linkage_list[j] = [node_i, node_j, min_dij, N_leaves_list[new_node]]
+    tree_dic[new_node] = pair
+
+    active_node[pair] = False
+    active_node[new_node] = True
+
+    # The new pseudojet goes in the slot of pair[0], the slot of pair[1] is deleted
+    slot_node[slot_i] = new_node
+    pt[slot_i] = np.absolute(jet_content[new_node][0])
+    norm[slot_i] = np.linalg.norm(jet_content[new_node])
+    weight[slot_i] = pt[slot_i] ** (2 * alpha)
+    active[slot_j] = False
+    angles[slot_j, :] = np.inf
+    angles[:, slot_j] = np.inf
+    near_angle[slot_j] = np.inf
+
+    # Update the row and column of the new pseudojet (dijRow with alpha=0 gives the squared angles)
+    others = np.flatnonzero(active)
+    others = others[others != slot_i]
+
+    new_row = np.full(Nconst, np.inf, dtype=angles.dtype)
+    new_row[others] = dijRow(jet_content[slot_node[others]],
+                             pt[others],
+                             norm[others],
+                             jet_content[new_node],
+                             pt[slot_i],
+                             norm[slot_i],
+                             alpha=0)
+    angles[slot_i, :] = new_row
+    angles[:, slot_i] = new_row
+
+    if trace is not None:
+      trace.record("merge",
+                   method="matrix",
+                   level=j,
+                   pair=(int(node_i), int(node_j)),
+                   dij=float(min_dij),
+                   cos_anomalies=_cosAnomalies(jet_content[slot_node[others]], jet_content[new_node]))
+
+    # Rows whose nearest neighbour was one of the merged pseudojets are recomputed. The others only change if the new
+    # pseudojet is closer.
+    stale = np.flatnonzero(active & ((near == slot_i) | (near == slot_j)))
+    stale = np.union1d(stale, [slot_i])
+    closer = active & (new_row < near_angle)
+    near_angle[closer] = new_row[closer]
+    near[closer] = slot_i
+    near[stale] = np.argmin(angles[stale], axis=1)
+    near_angle[stale] = angles[stale, near[stale]]
+
+  idx = np.flatnonzero(active_node)
+
+  return tree_dic, idx, jet_content, root_node, Nconst, N_leaves_list, linkage_list
+
+
+
+
+
+
+def ktAntiktCANN(const_list, alpha=None):
+  """
+  Approximate nearest neighbour version of ktAntiktCA (method "nn_approx" in recluster), that uses that the jet constituents are 2D momentum vectors (py,pz).
+  The angular distance between 2 pseudojets is then the difference of their (single) angle, and for the pair with the
+  min d_ij=min(pTi^(2\alpha),pTj^(2\alpha)) * angle^2, the pseudojet with the lowest pTi^(2\alpha) has the other one as
+  its nearest neighbour in angle. So we only need the d_ij between neighbours in a ring of pseudojets sorted by angle.
+  - The ring is stored as a doubly linked list (ring_next, ring_prev). When 2 neighbours are merged, the new pseudojet
+    (with an angle between them) replaces them in the same position of the ring.
+  - The d_ij of the pairs of neighbours are kept in a heap. Entries of pairs that are not neighbours anymore are dropped
+    when they get to the top of the heap.
+  Each level costs O(log N), so the clustering is O(N log N).
+
+  The d_ij are computed with the same expression as in dijMinPair, and ties are broken with the lowest pair of node ids.
+  This is not exact: when the epsilon used for numerical stability in the cosine matters (soft pseudojets, with
+  |pi|*|pj| of order 1 or below), d_ij is not strictly a function of the angle and the pair with the min d_ij can be
+  separated by a soft pseudojet in the ring. Jets with soft constituents often get a different tree than with the
+  exact engines (see recluster and compare_methods).
+
+  Args:
+      - const_list: jet constituents (i.e. the leaves of the tree)
+      - alpha: defines the clustering algorithm. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
+
+  Returns:
+      Same outputs as ktAntiktCA: tree_dic, idx, jet_content, root_node, Nconst, N_leaves_list, linkage_list
+  """
+
+  const_list = np.asarray(const_list).reshape(-1, 2)
+  Nconst = len(const_list)
+
+  root_node = 2 * Nconst - 2
+  logger.debug(f"Root node = (N constituents + N parent) = {root_node}")
+
+  jet_content, N_leaves_list, active, linkage_list = _clusteringBuffers(const_list)
+  tree_dic = {}
+
+  pt = np.absolute(jet_content[:, 0])
+  norm = np.linalg.norm(jet_content, axis=1)
+
+  # Ring of pseudojets sorted by angle
+  ring = np.argsort(np.arctan2(const_list[:, 1], const_list[:, 0]), kind="stable")
+  ring_next = np.full(2 * Nconst - 1, -1)
+  ring_prev = np.full(2 * Nconst - 1, -1)
+  ring_next[ring] = np.roll(ring, -1)
+  ring_prev[ring] = np.roll(ring, 1)
+
+  trace = get_diagnostics()
+
+  def _dij(i, j):
+    return dijRow(jet_content[[i]], pt[[i]], norm[[i]], jet_content[j], pt[j], norm[j], alpha=alpha)[0]
+
+  # Heap with the d_ij of each pair of neighbours in the ring, as (d_ij, lowest node id, highest node id)
+  heap = []
+  if Nconst > 1:
+    neighbours = ring_next[ring]
+    ring_dij = dijRow(jet_content[ring], pt[ring], norm[ring],
+                      jet_content[neighbours].T, pt[neighbours], norm[neighbours],
+                      alpha=alpha)
+    heap = list(zip(ring_dij, np.minimum(ring, neighbours), np.maximum(ring, neighbours)))
+    heapq.heapify(heap)
+
+  for j in range(Nconst - 1):
+
+    # Get the pair of neighbours with the min dij
+    while True:
+      min_dij, node_i, node_j = heapq.heappop(heap)
+      if active[node_i] and active[node_j] and (ring_next[node_i] == node_j or ring_next[node_j] == node_i):
+        break
+
+    new_node = Nconst + j
+    jet_content[new_node] = jet_content[node_i] + jet_content[node_j]
+    pt[new_node] = np.absolute(jet_content[new_node][0])
+    norm[new_node] = np.linalg.norm(jet_content[new_node])
+    N_leaves_list[new_node] = N_leaves_list[node_i] + N_leaves_list[node_j]
+
+    linkage_list[j] = [node_i, node_j, min_dij, N_leaves_list[new_node]]
+    tree_dic[new_node] = np.asarray([node_i, node_j])
+
+    if trace is not None:
+      trace.record("merge",
+                   method="nn_approx",
+                   level=j,
+                   pair=(int(node_i), int(node_j)),
+                   dij=float(min_dij),
+                   cos_anomalies=_cosAnomalies(jet_content[node_i], jet_content[node_j]))
+
+    active[[node_i, node_j]] = False
+    active[new_node] = True
+
+    # Replace the merged pseudojets by the new one in the ring
+    left, right = (node_i, node_j) if ring_next[node_i] == node_j else (node_j, node_i)
+    prev_node, next_node = ring_prev[left], ring_next[right]
+
+    if prev_node == right:
+      # Only the new pseudojet is left
+      ring_prev[new_node] = ring_next[new_node] = new_node
+
+    else:
+      ring_prev[new_node], ring_next[new_node] = prev_node, next_node
+      ring_next[prev_node], ring_prev[next_node] = new_node, new_node
+
+      heapq.heappush(heap, (_dij(prev_node, new_node), prev_node, new_node))
+      if next_node != prev_node:
+        heapq.heappush(heap, (_dij(next_node, new_node), next_node, new_node))
+
+  idx = np.flatnonzero(active)
+
+  return tree_dic, idx, jet_content, root_node, Nconst, N_leaves_list, linkage_list
+
+
+
+
+
+
+def dijRow(p_list, pt_list, norm_list, p, pt, norm, alpha=None):
+  """
+  Vectorized d_ij between one pseudojet p and a list of pseudojets, with the same expression used in dijMinPair:
+  dij=min(pTi^(2\alpha),pTj^(2\alpha)) * [arccos((pi.pj)/|pi|*|pj|)]^2
+
+  Args:
+      - p_list, pt_list, norm_list: momentum, pT and norm of the list of pseudojets.
+      - p, pt, norm: momentum, pT and norm of the pseudojet.
+      - alpha: defines the clustering algorithm. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
+
+  Returns:
+      array with the d_ij
+  """
+  epsilon = 1e-6 #For numerical stability
+  cos = (p_list[..., 0] * p[0] + p_list[..., 1] * p[1]) / (epsilon + norm_list * norm)
+
+  return np.minimum(pt_list ** (2 * alpha), pt ** (2 * alpha)) * np.arccos(np.clip(cos, -1., 1.)) ** 2
+
+
+
+
+
+
+def angleMatrix(const_list, norm=None):
+  """
+  N x N matrix with the squared angle [arccos((pi.pj)/|pi|*|pj|)]^2 between all the pseudojets in const_list, computed
+  as in dijRow.
+  """
+  const_list = np.asarray(const_list).reshape(-1, 2)
+  if norm is None:
+    norm = np.linalg.norm(const_list, axis=1)
+
+  epsilon = 1e-6 #For numerical stability
+  p_i = const_list[:, np.newaxis, :]
+  p_j = const_list[np.newaxis, :, :]
+  cos = (p_i[..., 0] * p_j[..., 0] + p_i[..., 1] * p_j[..., 1]) / (epsilon + norm[:, np.newaxis] * norm[np.newaxis, :])
+
+  return np.arccos(np.clip(cos, -1., 1.)) ** 2
+
+
+
+
+
+
+# Clustering engines that can be selected in recluster. All of them give the same tree
+clustering_methods = {
+  "bruteforce": ktAntiktCA,
+  "matrix": ktAntiktCAMatrix,
+}
+
+# Approximate clustering engines, that can give a different tree (see ktAntiktCANN)
+approximate_methods = {
+  "nn_approx": ktAntiktCANN,
+}
+
+# Names of the algorithms for each value of alpha (e.g. for figure names)
+algorithm_names = {-1: "antikt", 0: "CA", 1: "kt"}
+
+
+
+
+
+
+def _clusteringMethod(method):
+  """
+  Clustering function of an exact or approximate clustering engine
+  """
+  if method in clustering_methods:
+    return clustering_methods[method]
+  if method in approximate_methods:
+    return approximate_methods[method]
+
+  raise ValueError(f"Unknown clustering method {method!r}, use one of {list(clustering_methods) + list(approximate_methods)}")
 
 
 
@@ -332,7 +840,7 @@ def _traverse(
         dendrogram=True,
 ):
     """
-    This function call the recursive function _traverse_rec to make the trees starting from the root
+    Build the reclustered tree starting from the root, with the non-recursive traversal in traversal.traverse.
     :param root: root node id
     :param jet_nodes: array with the momentum of all the nodes of the jet tree (both leaves and inners).
     :param tree_dic: dictionary that has the node id of a parent as a key and a list with the id of the 2 children as the values
@@ -346,137 +854,67 @@ def _traverse(
     that we picked when we did the reclustering.). However, the idx value specifies the order in which the leaf nodes appear when traversing the origianl jet (e.g. truth level) jet . The value here is an integer between 0 and Nleaves.
     So if we went from truth to kt algorithm, then in the truth tree the leaves go as [0,1,2,3,4,,...,Nleaves-1]
     - tree_ancestors: List with one entry for each leaf of the tree, where each entry lists all the ancestor node ids when traversing the tree from the root to the leaf node.
+      (lazy traversal.TreeAncestors view)
+    - parent: int32 array with the parent of each node of the reclustered tree (-1 for the root).
+    - depth: int32 array with the number of steps from the root to each node of the reclustered tree.
 
     """
 
-    tree = []
-    content = []
-    node_id = []
-    tree_ancestors = []
+    # Children of each node id of the clustering. Leaves (node id < Nleaves) have [-1,-1]
+    raw_tree = np.full((len(jet_nodes), 2), -1)
+    if tree_dic:
+        raw_tree[list(tree_dic.keys())] = list(tree_dic.values())
 
-    _traverse_rec(
-    root,
-    -1,
-    False,
-    tree,
-    content,
-    jet_nodes,
-    tree_dic=tree_dic,
-    Nleaves=Nleaves,
-    node_id=node_id,
-    ancestors=[],
-    tree_ancestors=tree_ancestors,
-    dendrogram=dendrogram,
-    )
+    preorder, leaves, parent, depth, children = traversal.traverse(raw_tree, root)
 
-    return tree, content, node_id, tree_ancestors
+    tree = children.reshape(-1)
+    content = np.asarray(jet_nodes)[preorder]
+    node_id = leaves.tolist()
 
+    # Parent and depth of each node of the reclustered tree
+    parent, depth = traversal.relabel(preorder, parent, depth)
 
+    # The tree ancestors are stored as a lazy view on the parent array. The entries list the node ids of the clustering
+    # history (the labels), as the nodes in the reclustered tree are labeled in preorder.
+    tree_ancestors = []
+    if dendrogram:
+        leaves_position = np.flatnonzero(children[:, 0] == -1).astype(np.int32)
+        tree_ancestors = traversal.TreeAncestors(parent, leaves_position, labels=preorder)
 
+    return tree, content, node_id, tree_ancestors, parent, depth
 
 
 
-def _traverse_rec(
-        root,
-        parent_id,
-        is_left,
-        tree,
-        content,
-        jet_nodes,
-        tree_dic=None,
-        Nleaves=None,
-        node_id=None,
-        ancestors=None,
-        tree_ancestors=[],
-        dendrogram=False,
-):
-    """
-    Recursive function to build the jet tree structure.
-    :param root: parent node momentum
-    :param parent_id: parent node idx
-    :param is_left: bool.
-    :param tree: List with the tree
-    :param content: List with the momentum vectors
-    :param jet_nodes: array with the momentum of all the nodes of the jet tree (both leaves and inners).
-    :param tree_dic: dictionary that has the node id of a parent as a key and a list with the id of the 2 children as the values
-    :param Nleaves: Number of constituents (leaves)
-    :param node_id: list where leaves idxs are added in the order they appear when we traverse the reclustered tree (each number indicates the node id
-    that we picked when we did the reclustering.). However, the idx value specifies the order in which the leaf nodes appear when traversing the truth level jet . The value here is an integer between 0 and Nleaves.
-    So if we went from truth to kt algorithm, then in the truth tree the leaves go as [0,1,2,3,4,,...,Nleaves-1]
-    :param ancestors: 1 entry of tree_ancestors (there is one for each leaf of the tree). It is appended to tree_ancestors.
-    :param tree_ancestors: List with one entry for each leaf of the tree, where each entry lists all the ancestor node ids when traversing the tree from the root to the leaf node.
-    :param dendrogram: bool. If True, append ancestors to tree_ancestors list.
-    """
 
 
-    id = len(tree) // 2
-    if parent_id >= 0:
-        if is_left:
-            tree[2 * parent_id] = id  # We set the location of the lef child in the content array. So the left child momentum will be content[tree[2 * parent_id]]
-        else:
-            tree[2 * parent_id + 1] = id  # We set the location of the right child in the content array. So the right child will be content[tree[2 * parent_id+1]]
-    """"(With each 4-vector we increase the content array by one element and the tree array by 2 elements. But then we take id=tree.size()//2, so the id increases by 1. The left and right children are added one after the other.)"""
 
+def _generatedJet(Nconst, seed=0):
+  """
+  Random jet with Nconst constituents, to check the clustering engines: starting from a single (py,pz) momentum, split
+  a random leaf in 2 at each step, with a random momentum fraction and a small rotation. It has both hard and soft
+  constituents.
+  """
+  rng = np.random.default_rng(seed)
+  tree = [[-1, -1]]
+  content = [np.array([500., 200.])]
+  leaves = [0]
+
+  while len(leaves) < Nconst:
+    node = leaves.pop(rng.integers(len(leaves)))
+    fraction, rotation = rng.uniform(0.2, 0.8), rng.normal(0, 0.05)
+    cos, sin = np.cos(rotation), np.sin(rotation)
+    left = fraction * np.array([cos * content[node][0] - sin * content[node][1],
+                                sin * content[node][0] + cos * content[node][1]])
+
+    tree[node] = [len(tree), len(tree) + 1]
+    tree += [[-1, -1], [-1, -1]]
+    content += [left, content[node] - left]
+    leaves += [len(tree) - 2, len(tree) - 1]
+
+  return {"root_id": 0, "tree": np.asarray(tree), "content": np.asarray(content), "name": f"generated_{Nconst}_{seed}"}
 
-    # Insert 2 new nodes to the vector that constitutes the tree.
-    # In the next iteration we will replace this 2 values with the location of the parent of the new nodes
-    tree.append(-1)
-    tree.append(-1)
 
-    # Fill the content vector with the values of the node
-    content.append(jet_nodes[root])
 
-    new_ancestors = None
-    if dendrogram:
-        new_ancestors = np.copy(ancestors)
-        logger.debug(f" ancestors before = {ancestors}")
-        new_ancestors = np.append(new_ancestors, root)  # Node ids in terms of the truth jet dictionary
-        logger.debug(f" ancestors after = {ancestors}")
-
-
-    # We move from the root down until we get to the leaves. We do this recursively
-    if root >= Nleaves:
-
-        children = tree_dic[root]
-        logger.debug(f"Children = {children}")
-
-        L_idx = children[0]
-        R_idx = children[1]
-
-
-        _traverse_rec(L_idx, id,
-                      True,
-                      tree,
-                      content,
-                      jet_nodes,
-                      tree_dic,
-                      Nleaves=Nleaves,
-                      node_id=node_id,
-                      ancestors=new_ancestors,
-                      dendrogram=dendrogram,
-                      tree_ancestors=tree_ancestors,
-                      )
-
-        _traverse_rec(R_idx,
-                      id,
-                      False,
-                      tree,
-                      content,
-                      jet_nodes,
-                      tree_dic,
-                      Nleaves=Nleaves,
-                      node_id=node_id,
-                      ancestors=new_ancestors,
-                      dendrogram=dendrogram,
-                      tree_ancestors=tree_ancestors,
-                      )
-
-    # If not then its a leaf
-    else:
-        node_id.append(root)
-        if dendrogram:
-            tree_ancestors.append(new_ancestors)
-            logger.debug(f"tree_ancestors= {tree_ancestors}")
 
 
 
@@ -484,10 +922,39 @@ if __name__== "__main__":
 
   input_dir = '../data/'
   input_jet = 'tree_0_truth'
-  with open(input_dir + str(input_jet) + '.pkl', "rb") as fd:
-    truth_jet = pickle.load(fd, encoding='latin-1')[0]
 
-  jet_name = ('_').join(input_jet.split('_')[-3:-1])
-  truth_jet["name"] = jet_name
+  # Read the truth jets from a jet store (memory mapped, one jet at a time). The legacy pickle files have a list of
+  # jets that is loaded whole, so they are packed into the store the first time.
+  from scripts import jetStore
+  store_path = input_dir + 'truth_jets.jetstore'
+  if not os.path.exists(store_path):
+    jetStore.pack_pickles(input_dir + 'tree_*_truth.pkl', store_path)
+  store = jetStore.JetStore(store_path)
 
-  reclusterKt = recluster(truth_jet, alpha=1)
\ No newline at end of file
+  jet_name = ('_').join(input_jet.split('_')[-3:-1])
+  truth_jet = store.get(jet_name, "truth")
+
+  reclusterKt = recluster(truth_jet, alpha=1)
+
+  # Check the matrix clustering against the brute force one, and count the trees that differ for the approximate nearest
+  # neighbour clustering, on the truth jets and on generated jets with soft constituents
+  jets = list(store)
+  jets += [_generatedJet(60, seed=seed) for seed in range(3)]
+
+  for method, mismatches in compare_methods(jets, alphas=(-1, 0, 1), methods=("matrix", "nn_approx")).items():
+    logger.info(f"{method} -- Same tree as the bruteforce method for {3 * len(jets) - len(mismatches)} of {3 * len(jets)} trees")
+    if mismatches:
+      log = logger.info if method in approximate_methods else logger.warning
+      log(f"{method} -- Different trees (jet, alpha): {mismatches}")
+
+  # Time the matrix engine on generated jets: each level costs O(N), so doubling N should multiply the time by ~4 for
+  # kt, CA and anti-kt
+  for alpha in [-1, 0, 1]:
+    seconds = []
+    for Nconst in [1000, 2000]:
+      jet_const = getConstituents(_generatedJet(Nconst))
+      start = time.perf_counter()
+      ktAntiktCAMatrix(jet_const, alpha=alpha)
+      seconds.append(time.perf_counter() - start)
+    logger.info(f"alpha = {alpha} -- matrix method: {seconds[0]:.2f} s for N=1000, {seconds[1]:.2f} s for N=2000 "
+                f"(ratio {seconds[1] / seconds[0]:.1f}, O(N^2) gives 4)")
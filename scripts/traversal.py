@@ -0,0 +1,376 @@
+import numpy as np
+import logging
+
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+
+
+
+
+def traverse(tree, root_id=0):
+	'''
+	Non-recursive traversal of a binary tree. It uses an explicit stack, so it does not hit Python's recursion limit for
+	deep trees (e.g. the anti-kt ladders), and it visits each node once.
+
+	Args:
+	- tree: array with the [left, right] children of each node. If [-1,-1] then the node is a leaf.
+	- root_id: node id of the starting node (root of the tree).
+
+	Returns:
+	- preorder: node ids in the order in which they are accessed when traversing the tree (node, left branch, right branch).
+	- leaves: node ids of the leaves in the order in which they are accessed when traversing the tree.
+	- parent: parent node id of each node (-1 for the root and for the nodes that are not below root_id).
+	- depth: number of steps from the root to each node (-1 for the nodes that are not below root_id).
+	- children: [left, right] children of each node, with nodes labeled by their position in preorder. This is the tree
+	  structure of the jet dictionaries, where the root is node 0.
+	'''
+
+	tree = np.asarray(tree).reshape(-1, 2)
+	left_list = tree[:, 0].tolist()
+	right_list = tree[:, 1].tolist()
+
+	parent = np.full(len(tree), -1, dtype=np.int32)
+	depth = np.full(len(tree), -1, dtype=np.int32)
+	preorder = []
+	leaves = []
+
+	depth[root_id] = 0
+	stack = [root_id]
+
+	while stack:
+		node_id = stack.pop()
+		preorder.append(node_id)
+
+		left = left_list[node_id]
+		if left == -1:
+			leaves.append(node_id)
+
+		else:
+			right = right_list[node_id]
+			parent[left] = parent[right] = node_id
+			depth[left] = depth[right] = depth[node_id] + 1
+
+			# Push the right child first so that the left branch is visited first
+			stack.append(right)
+			stack.append(left)
+
+	preorder = np.asarray(preorder, dtype=np.int32)
+	leaves = np.asarray(leaves, dtype=np.int32)
+
+	# Relabel the children with the position of each node in preorder. The extra last entry maps the -1 of the leaves to -1
+	position = np.full(len(tree) + 1, -1, dtype=np.int32)
+	position[preorder] = np.arange(len(preorder), dtype=np.int32)
+	children = position[tree[preorder]]
+
+	return preorder, leaves, parent, depth, children
+
+
+
+
+
+
+def ancestors(parent, nodes, labels=None):
+	'''
+	List with one entry for each node in nodes, where each entry lists all the ancestor node ids when traversing the tree
+	from the root to the node (including the node). This is the format of jet["tree_ancestors"].
+
+	Args:
+	- parent: parent node id of each node (-1 for the root), from traverse.
+	- nodes: node ids, e.g. the leaves from traverse.
+	- labels: (optional) label of each node to store in the entries instead of the node id.
+
+	Returns:
+	  list of float arrays
+	'''
+
+	parent_list = np.asarray(parent).tolist()
+	labels = np.arange(len(parent_list)) if labels is None else np.asarray(labels)
+
+	tree_ancestors = []
+	for node_id in np.asarray(nodes).tolist():
+		path = []
+		while node_id != -1:
+			path.append(node_id)
+			node_id = parent_list[node_id]
+
+		tree_ancestors.append(labels[path[::-1]].astype(np.float64))
+
+	return tree_ancestors
+
+
+
+
+
+
+def traverse_jet(jet):
+	'''
+	traverse of the tree of a jet dictionary. For a jetTree.JetTree, the cached traversal is returned (shared, so the
+	outputs should not be modified).
+	'''
+	if hasattr(jet, "traversal"):
+		return jet.traversal
+
+	return traverse(jet["tree"], jet["root_id"])
+
+
+
+
+
+
+def relabel(preorder, parent, depth):
+	'''
+	Parent and depth arrays for the tree relabeled in preorder (see the children output of traverse), i.e. where the
+	node id of each node is its position in preorder.
+	'''
+	position = np.full(len(parent) + 1, -1, dtype=np.int32)
+	position[preorder] = np.arange(len(preorder), dtype=np.int32)
+
+	return position[parent[preorder]], depth[preorder]
+
+
+
+
+
+
+def subtree_leaves(children):
+	'''
+	Leaves below each node of a tree relabeled in preorder (see the children output of traverse). The leaves below a
+	node are consecutive in preorder.
+
+	Returns:
+	- leaf_start: index (in the list of leaves in preorder) of the first leaf below each node.
+	- n_leaves: number of leaves below each node.
+	'''
+	is_leaf = children[:, 0] == -1
+	leaf_start = np.cumsum(is_leaf) - is_leaf
+
+	# Children come after their parent in preorder
+	n_leaves = is_leaf.astype(np.int64).tolist()
+	left_list, right_list = children[:, 0].tolist(), children[:, 1].tolist()
+	for node in np.flatnonzero(~is_leaf)[::-1].tolist():
+		n_leaves[node] = n_leaves[left_list[node]] + n_leaves[right_list[node]]
+
+	return leaf_start, np.asarray(n_leaves, dtype=np.int64)
+
+
+
+
+
+
+def min_uint_dtype(max_value):
+	'''
+	Smallest unsigned integer dtype that can hold max_value
+	'''
+	for dtype in (np.uint8, np.uint16, np.uint32):
+		if max_value <= np.iinfo(dtype).max:
+			return dtype
+
+	return np.uint64
+
+
+
+
+
+
+class TreeAncestors(object):
+	'''
+	Lazy, read-only view with the same format as the jet["tree_ancestors"] list: one entry for each leaf of the tree,
+	where each entry lists all the ancestor node ids when traversing the tree from the root to the leaf node.
+	Entries are built on demand from the parent array, so the jet only stores O(N) integers instead of O(N*depth)
+	floats (O(N^2) for anti-kt ladders).
+
+	Args:
+	- parent: parent node id of each node (-1 for the root), from traverse.
+	- leaves: leaves node ids in the order in which they are accessed when traversing the tree.
+	- labels: (optional) label of each node to store in the entries instead of the node id (e.g. the node ids of the
+	  clustering history for reclustered jets).
+	'''
+
+	def __init__(self, parent, leaves, labels=None):
+		self.parent = parent
+		self.leaves = leaves
+		self.labels = labels
+
+	def __len__(self):
+		return len(self.leaves)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return ancestors(self.parent, self.leaves[i], labels=self.labels)
+
+		return ancestors(self.parent, [self.leaves[i]], labels=self.labels)[0]
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def __repr__(self):
+		return "TreeAncestors(%d leaves)" % len(self)
+
+	def tolist(self):
+		'''
+		Materialize the full list of tree ancestors arrays
+		'''
+		return ancestors(self.parent, self.leaves, labels=self.labels)
+
+
+
+
+
+
+class LCAIndex(object):
+	'''
+	Lowest common ancestor (LCA) index of a tree, built once per jet with an Euler tour of the tree and a sparse table
+	for range min queries (RMQ) over the depth of the tour. The LCA of 2 nodes is the node with min depth in the tour
+	between their first occurrences, so each query is O(1) (2 lookups in the sparse table) and queries are vectorized
+	over arrays of nodes.
+
+	Leaf queries (leaf_lca_depth, path_length, max_steps) take leaf indices, i.e. positions in self.leaves (the order in
+	which the leaves are accessed when traversing the tree, the rows of the heat maps).
+
+	Args:
+	- tree: array with the [left, right] children of each node. If [-1,-1] then the node is a leaf.
+	- root_id: node id of the root of the tree.
+	'''
+
+	def __init__(self, tree, root_id=0):
+		tree = np.asarray(tree).reshape(-1, 2)
+		self.preorder, self.leaves, self.parent, self.depth, children = traverse(tree, root_id)
+
+		# Euler tour: each node is added when we get to it and after visiting each of its children
+		left_list = tree[:, 0].tolist()
+		right_list = tree[:, 1].tolist()
+
+		euler = []
+		stack = [(root_id, 0)]
+		while stack:
+			node_id, visited = stack.pop()
+			euler.append(node_id)
+
+			if left_list[node_id] != -1 and visited < 2:
+				stack.append((node_id, visited + 1))
+				stack.append((left_list[node_id] if visited == 0 else right_list[node_id], 0))
+
+		self.euler = np.asarray(euler, dtype=np.int32)
+		euler_depth = self.depth[self.euler]
+
+		# Position of the first occurrence of each node in the tour
+		self.first = np.full(len(tree), -1, dtype=np.int64)
+		nodes, first = np.unique(self.euler, return_index=True)
+		self.first[nodes] = first
+
+		# Sparse table: table[k, i] is the position of the min depth node in the tour between i and i + 2^k - 1
+		length = len(self.euler)
+		self._log = np.zeros(length + 1, dtype=np.int64)
+		self._log[2:] = np.floor(np.log2(np.arange(2, length + 1))).astype(np.int64)
+
+		table = np.zeros((self._log[length] + 1, length), dtype=np.int32)
+		table[0] = np.arange(length)
+		for k in range(1, len(table)):
+			half = 2 ** (k - 1)
+			size = length - 2 ** k + 1
+			a, b = table[k - 1, :size], table[k - 1, half:half + size]
+			table[k, :size] = np.where(euler_depth[b] < euler_depth[a], b, a)
+
+		self._table = table
+		self._euler_depth = euler_depth
+
+	@classmethod
+	def from_jet(cls, jet):
+		'''
+		LCA index of a jet dictionary, or the cached one of a jetTree.JetTree
+		'''
+		if hasattr(jet, "lca_index"):
+			return jet.lca_index
+
+		return cls(jet["tree"], jet["root_id"])
+
+	def lca(self, u, v):
+		'''
+		LCA node id of the nodes u and v (node ids, or arrays of node ids)
+		'''
+		first_u, first_v = self.first[u], self.first[v]
+		low = np.minimum(first_u, first_v)
+		high = np.maximum(first_u, first_v)
+
+		k = self._log[high - low + 1]
+		a = self._table[k, low]
+		b = self._table[k, high - 2 ** k + 1]
+
+		return self.euler[np.where(self._euler_depth[b] < self._euler_depth[a], b, a)]
+
+	def leaf_lca_depth(self, i, j):
+		'''
+		Depth of the LCA of the leaves with indices i and j
+		'''
+		return self.depth[self.lca(self.leaves[i], self.leaves[j])]
+
+	def path_length(self, i, j):
+		'''
+		Total number of steps to connect the leaves with indices i and j (the full_path heat data)
+		'''
+		d_i, d_j = self.depth[self.leaves[i]], self.depth[self.leaves[j]]
+
+		return d_i + d_j - 2 * self.leaf_lca_depth(i, j)
+
+	def max_steps(self, i, j):
+		'''
+		Max number of steps for the leaves with indices i and j to reach their LCA
+		'''
+		d_i, d_j = self.depth[self.leaves[i]], self.depth[self.leaves[j]]
+
+		return np.maximum(d_i, d_j) - self.leaf_lca_depth(i, j)
+
+	def leaves_lca_depth(self):
+		'''
+		Matrix with the LCA depth of all the pairs of leaves. The LCA depth of leaves i<j is the min of the LCA depth of
+		the consecutive leaves between them, so each row is a cumulative min of the consecutive leaves LCA depths.
+		'''
+		N = len(self.leaves)
+		consecutive = self.leaf_lca_depth(np.arange(N - 1), np.arange(1, N))
+
+		lca_depth = np.diag(self.depth[self.leaves]).astype(np.int64)
+		for i in range(N - 1):
+			row = np.minimum.accumulate(consecutive[i:])
+			lca_depth[i, i + 1:] = row
+			lca_depth[i + 1:, i] = row
+
+		return lca_depth
+
+	def condensed_heat_data(self):
+		'''
+		Condensed form (upper triangle by rows, as in scipy.spatial.distance.squareform) of the full path and max steps
+		heat data, with the smallest unsigned integer dtype that fits the number of steps. Each row is filled from the
+		cumulative min of the consecutive leaves LCA depths, without building the N x N matrices.
+		'''
+		N = len(self.leaves)
+		leaves_depth = self.depth[self.leaves].astype(np.int64)
+		consecutive = self.leaf_lca_depth(np.arange(N - 1), np.arange(1, N))
+
+		dtype = min_uint_dtype(2 * leaves_depth.max() if N else 0)
+		full_path_data = np.zeros(N * (N - 1) // 2, dtype=dtype)
+		max_steps_data = np.zeros(N * (N - 1) // 2, dtype=dtype)
+
+		start = 0
+		for i in range(N - 1):
+			lca_depth = np.minimum.accumulate(consecutive[i:])
+			end = start + len(lca_depth)
+			full_path_data[start:end] = leaves_depth[i] + leaves_depth[i + 1:] - 2 * lca_depth
+			max_steps_data[start:end] = np.maximum(leaves_depth[i], leaves_depth[i + 1:]) - lca_depth
+			start = end
+
+		return full_path_data, max_steps_data
+
+	def heat_data(self):
+		'''
+		Full path and max steps heat data matrices for all the pairs of leaves (see heatClustermap.getHeatData)
+		'''
+		leaves_depth = self.depth[self.leaves].astype(np.float64)
+		lca_depth = self.leaves_lca_depth()
+
+		full_path_data = leaves_depth[:, None] + leaves_depth[None, :] - 2 * lca_depth
+		max_steps_data = np.maximum.outer(leaves_depth, leaves_depth) - lca_depth
+
+		return full_path_data, max_steps_data
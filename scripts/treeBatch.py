@@ -0,0 +1,152 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from scripts import Tree1D
+from scripts import reclusterTree
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+
+
+
+
+def render_tree_pairs(
+		jets,
+		out_dir,
+		pairs = (("truth", 1), ("truth", 0), ("truth", -1)),
+		truthOrder = True,
+		label = True,
+		figFormat = "pdf",
+		n_jobs = None,
+		method = "matrix",
+):
+	"""
+	Render the 1D tree pairs (top/bottom, see Tree1D.visualizeTreePair) of a list of truth jets to disk, e.g. for review
+	galleries. For each jet and each pair of algorithms (a, b) we save {name}_{a}_{b}_top and {name}_{a}_{b}_bottom.
+
+	Each Graphviz render is a blocking dot subprocess, so the renders run in a bounded pool of threads (the GIL is
+	released while waiting for dot): the Digraphs are built in the calling thread while up to n_jobs dot processes run,
+	and at most 2 * n_jobs figures are pending at any time.
+
+	Args:
+	:param jets: list (or iterable) of truth jet dictionaries.
+	:param out_dir: dir for the figures.
+	:param pairs: pairs of algorithms to compare. Each algorithm is "truth" or a value of alpha, where alpha={-1,0,1}
+	 defines the {anti-kt, CA and kt} algorithms respectively.
+	:param truthOrder: leaves order (see Tree1D.visualizeTreePair).
+	:param label: if True, then add labels with info to each node.
+	:param figFormat: figure format, e.g. pdf or png.
+	:param n_jobs: number of concurrent dot processes. If None, use all the cores.
+	:param method: clustering engine (see reclusterTree.recluster).
+
+	Returns:
+	 list with one dictionary for each figure, in the order in which they were built, with keys "jet", "pair", "figure"
+	 (saved file), "seconds" (render time) and "error" (None, or the exception raised when building or rendering the
+	 figure; a failure does not stop the other figures).
+	"""
+
+	os.makedirs(out_dir, exist_ok=True)
+	n_jobs = n_jobs or os.cpu_count() or 1
+	alphas = sorted({alg for pair in pairs for alg in pair if alg != "truth"})
+
+	records = []
+	pending = set()
+	start = time.perf_counter()
+
+	with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+		for i, truth_jet in enumerate(jets):
+			name = str(truth_jet.get("name", i))
+
+			try:
+				reclustered = reclusterTree.recluster_multi(truth_jet, alphas=alphas, save=False, method=method)
+			except Exception as error:
+				logger.warning(f"Reclustering failed for jet {i}: {error!r}")
+				records += [_record(i, pair, None, error) for pair in pairs]
+				continue
+
+			# The truth jets pickles do not have an "algorithm" key (see Tree1D.visualizeTreePair)
+			truth_jet = truth_jet.copy()
+			truth_jet["algorithm"] = "truth"
+
+			for pair in pairs:
+				label_a, label_b = [_algorithmName(alg) for alg in pair]
+				jet_a, jet_b = [truth_jet if alg == "truth" else reclustered[alg] for alg in pair]
+
+				try:
+					tree_top, tree_bottom = Tree1D.visualizeTreePair(
+						jet_a,
+						jet_b,
+						truthOrder=truthOrder,
+						label=label,
+						figFormat=figFormat,
+						alpha_jet1=None if pair[0] == "truth" else pair[0],
+						alpha_jet2=None if pair[1] == "truth" else pair[1],
+					)
+				except Exception as error:
+					records.append(_record(i, pair, None, error))
+					continue
+
+				for tree, position in ((tree_top, "top"), (tree_bottom, "bottom")):
+					# Keep a bounded number of figures waiting for a dot process
+					if len(pending) >= 2 * n_jobs:
+						done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+					record = _record(i, pair, os.path.join(out_dir, f"{name}_{label_a}_{label_b}_{position}"), None)
+					records.append(record)
+					pending.add(executor.submit(_renderWorker, tree, record))
+
+		wait(pending)
+
+	wall = time.perf_counter() - start
+	rendered = [record for record in records if record["error"] is None]
+	logger.info(f"Rendered {len(rendered)} tree figures in {wall:.2f} s "
+	            f"(total dot time {sum(record['seconds'] for record in rendered):.2f} s, {n_jobs} processes)")
+
+	for record in records:
+		if record["error"] is not None:
+			logger.warning(f"Tree figure failed for jet {record['jet']} {record['pair']}: {record['error']!r}")
+
+	return records
+
+
+
+
+
+
+def _renderWorker(tree, record):
+	"""
+	Render one Digraph with dot and fill the file name and render time of its record. Exceptions are stored in the
+	record instead of raised.
+	"""
+	start = time.perf_counter()
+
+	try:
+		record["figure"] = tree.render(filename=record["figure"], cleanup=True)
+	except Exception as error:
+		record["error"] = error
+
+	record["seconds"] = time.perf_counter() - start
+
+	return record
+
+
+
+
+
+
+def _record(jet, pair, figure, error):
+	return {"jet": jet, "pair": tuple(pair), "figure": figure, "seconds": 0., "error": error}
+
+
+
+
+
+
+def _algorithmName(algorithm):
+	if algorithm == "truth":
+		return "truth"
+
+	return reclusterTree.algorithm_names.get(algorithm, f"alpha_{algorithm}")
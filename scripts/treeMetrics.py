@@ -0,0 +1,223 @@
+import os
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.cluster.hierarchy import cophenet
+
+from scripts import traversal
+from scripts import linkageList
+from scripts import reclusterTree
+from scripts import heatClustermap
+from scripts.utils import get_logger
+
+logger = get_logger(level=logging.INFO)
+
+# One row for each (jet, algorithm)
+metrics_dtype = np.dtype([
+	("jet", np.int64),
+	("name", "U64"),
+	("alpha", np.float64),
+	("n_leaves", np.int64),
+	("cophenetic", np.float64),
+	("rf", np.int64),
+	("rf_norm", np.float64),
+	("heat_mad", np.float64),
+])
+
+
+
+
+
+def truth_order(reclustered_jet):
+	'''
+	Leaves of a jet reclustered from a truth jet, in the truth jet order: leaf k of the reclustered jet (in the order in
+	which the leaves are accessed when traversing its tree) is the truth jet leaf reclustered_jet["node_id"][k].
+	'''
+	return np.argsort(np.asarray(reclustered_jet["node_id"]), kind="stable")
+
+
+
+
+
+
+def cophenetic_correlation(truth_linkage, reclustered_linkage):
+	'''
+	Pearson correlation between the cophenetic distances of the leaves in 2 linkage lists. Leaf labels of the
+	reclustered linkage list are the jet constituents in the truth jet order, so both lists use the same labels.
+	Note that the heights of the truth linkage list are the step counter of linkageList.truth_linkage, and the heights
+	of the reclustered one are the d_ij of each merge, so the correlation is below 1 even for the same tree structure.
+	'''
+	if len(truth_linkage) < 2:
+		return np.nan
+
+	truth_cophenet = cophenet(np.asarray(truth_linkage, dtype=np.float64))
+	reclustered_cophenet = cophenet(np.asarray(reclustered_linkage, dtype=np.float64))
+
+	return np.corrcoef(truth_cophenet, reclustered_cophenet)[0, 1]
+
+
+
+
+
+
+def cluster_hashes(tree, root_id, leaf_labels, leaf_hash):
+	'''
+	Hash of the set of leaves below each inner node of a tree (except the root), as the sum (mod 2^64) of random hashes
+	of the leaf labels. The leaves below a node are consecutive in preorder, so each hash is a difference of cumulative
+	sums.
+
+	Args:
+	- tree, root_id: tree of the jet
+	- leaf_labels: label of each leaf, in the order in which they are accessed when traversing the tree
+	- leaf_hash: random uint64 hash of each label
+
+	Returns:
+	  array of uint64 cluster hashes
+	'''
+	preorder, leaves, parent, depth, children = traversal.traverse(tree, root_id)
+	is_leaf = children[:, 0] == -1
+
+	leaf_start, n_leaves = traversal.subtree_leaves(children)
+	cumulative = np.concatenate((np.zeros(1, dtype=np.uint64), np.cumsum(leaf_hash[np.asarray(leaf_labels)], dtype=np.uint64)))
+
+	inner = np.flatnonzero(~is_leaf)[1:]
+
+	return cumulative[leaf_start[inner] + n_leaves[inner]] - cumulative[leaf_start[inner]]
+
+
+
+
+
+
+def robinson_foulds(truth_jet, reclustered_jet, seed=0):
+	'''
+	Rooted Robinson-Foulds distance: number of clusters (sets of leaves below an inner node) that are only in one of the
+	2 trees. Clusters are compared by hashes of their leaves (see cluster_hashes).
+
+	Returns:
+	  RF distance, RF distance normalized by the total number of non trivial clusters
+	'''
+	N = len(reclustered_jet["node_id"])
+	leaf_hash = np.random.default_rng(seed).integers(0, 2 ** 63, size=N, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+	truth_hashes = cluster_hashes(truth_jet["tree"], truth_jet["root_id"], np.arange(N), leaf_hash)
+	reclustered_hashes = cluster_hashes(reclustered_jet["tree"],
+	                                    reclustered_jet["root_id"],
+	                                    np.asarray(reclustered_jet["node_id"]),
+	                                    leaf_hash)
+
+	rf = len(np.setdiff1d(truth_hashes, reclustered_hashes)) + len(np.setdiff1d(reclustered_hashes, truth_hashes))
+	total = len(truth_hashes) + len(reclustered_hashes)
+
+	return rf, rf / total if total else 0.
+
+
+
+
+
+
+def heat_mad(truth_jet, reclustered_jet, full_path=False):
+	'''
+	Mean absolute difference between the truth and reclustered heat data, over the pairs of different leaves.
+	'''
+	truth_heat = heatClustermap.getHeatData(truth_jet, condensed=True)[0 if full_path else 1]
+	reclustered_heat = heatClustermap.getHeatData(reclustered_jet, condensed=True)[0 if full_path else 1]
+
+	diff = truth_heat - reclustered_heat.reorder(truth_order(reclustered_jet))
+	if len(diff.data) == 0:
+		return 0.
+
+	return np.absolute(diff.data.astype(np.float64)).mean()
+
+
+
+
+
+
+def tree_metrics(truth_jet, reclustered_jet, full_path=False, truth_linkage=None):
+	'''
+	Similarity metrics between a truth jet and a jet reclustered from it (with reclusterTree.recluster).
+
+	Returns:
+	  cophenetic correlation, Robinson-Foulds distance, normalized Robinson-Foulds distance, mean absolute heat difference
+	'''
+	if truth_linkage is None:
+		truth_linkage = linkageList.truth_linkage(truth_jet)
+
+	rf, rf_norm = robinson_foulds(truth_jet, reclustered_jet)
+
+	return (cophenetic_correlation(truth_linkage, reclustered_jet["linkage_list"]),
+	        rf,
+	        rf_norm,
+	        heat_mad(truth_jet, reclustered_jet, full_path=full_path))
+
+
+
+
+
+
+def batch_metrics(jets, alphas=(1, 0, -1), full_path=False, n_jobs=None, chunksize=None, method="matrix"):
+	'''
+	Similarity metrics between each truth jet and the jet reclustered with each algorithm, splitting the jets in chunks
+	over a process pool. There is no plotting.
+
+	Args:
+	- jets: list (or iterable) of truth jet dictionaries.
+	- alphas: values of alpha to recluster each jet. alpha={-1,0,1} defines the {anti-kt, CA and kt} algorithms respectively.
+	- full_path: Bool. Heat data definition (see heatClustermap.heat_dendrogram).
+	- n_jobs: number of worker processes. If None, use all the cores. If 1, run in the current process.
+	- chunksize: number of jets sent to a worker at a time. If None, split the jets in ~4 chunks per worker.
+	- method: clustering engine (see reclusterTree.recluster).
+
+	Returns:
+	  structured array (metrics_dtype) with one row for each jet and algorithm. Rows of jets that failed have nan metrics.
+	'''
+	jets = list(jets)
+	n_jobs = n_jobs or os.cpu_count() or 1
+	if chunksize is None:
+		chunksize = max(1, len(jets) // (4 * n_jobs))
+
+	tasks = [(i, jet, tuple(alphas), full_path, method) for i, jet in enumerate(jets)]
+
+	if n_jobs == 1 or len(jets) <= 1:
+		results = list(map(_metricsWorker, tasks))
+
+	else:
+		with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+			results = list(executor.map(_metricsWorker, tasks, chunksize=chunksize))
+
+	metrics = np.zeros(len(jets) * len(alphas), dtype=metrics_dtype)
+	for i, result in enumerate(results):
+		rows = slice(i * len(alphas), (i + 1) * len(alphas))
+
+		if isinstance(result, Exception):
+			logger.warning(f"Metrics failed for jet {i}: {result!r}")
+			metrics[rows] = [(i, str(jets[i].get("name", i)), alpha, -1, np.nan, -1, np.nan, np.nan) for alpha in alphas]
+
+		else:
+			metrics[rows] = result
+
+	return metrics
+
+
+
+
+
+
+def _metricsWorker(task):
+	'''
+	Metrics of one jet for batch_metrics. Exceptions are returned instead of raised.
+	'''
+	i, jet, alphas, full_path, method = task
+
+	try:
+		reclustered = reclusterTree.recluster_multi(jet, alphas=alphas, save=False, method=method)
+		truth_linkage = linkageList.truth_linkage(jet)
+		name = str(jet.get("name", i))
+
+		return [(i, name, alpha, reclustered[alpha]["Nconst"]) +
+		        tree_metrics(jet, reclustered[alpha], full_path=full_path, truth_linkage=truth_linkage)
+		        for alpha in alphas]
+
+	except Exception as error:
+		return error
@@ -1,3 +1,4 @@
+import contextlib
 import logging
 
 
@@ -24,6 +25,70 @@ def get_logger(name=__file__, level=logging.DEBUG):
 
 
 
+class Diagnostics(object):
+    """
+    Structured record of diagnostic events, filled only when the trace mode is on (see diagnostics()).
+    Each event is a dictionary with an "event" key (e.g. "merge") and the fields given to record.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def record(self, event, **fields):
+        fields["event"] = event
+        self.events.append(fields)
+
+    def filter(self, event):
+        """
+        List of the recorded events of one type
+        """
+        return [entry for entry in self.events if entry["event"] == event]
+
+
+_diagnostics = None
+
+
+def get_diagnostics():
+    """
+    Current Diagnostics record, or None if the trace mode is off. Functions get it once and skip all the validation
+    work when it is None.
+    """
+    return _diagnostics
+
+
+def enable_diagnostics():
+    """
+    Turn on the trace mode and return the new (empty) Diagnostics record.
+    """
+    global _diagnostics
+    _diagnostics = Diagnostics()
+    return _diagnostics
+
+
+def disable_diagnostics():
+    global _diagnostics
+    _diagnostics = None
+
+
+@contextlib.contextmanager
+def diagnostics():
+    """
+    Turn on the trace mode inside a with block:
+
+        with diagnostics() as trace:
+            reclusterTree.recluster(jet, alpha=1, save=False)
+        trace.filter("merge")
+    """
+    global _diagnostics
+    previous = _diagnostics
+    _diagnostics = Diagnostics()
+    try:
+        yield _diagnostics
+    finally:
+        _diagnostics = previous
+
+
+
 # logger = logging.getLogger()
 # logger.setLevel(logging.DEBUG)
 # logging.debug("test")
\ No newline at end of file
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from scripts import jetStore
+
+
+def test_column_dtype_is_promoted(tmp_path):
+	path = str(tmp_path / "jets.jetstore")
+	content = np.array([[0.1, 0.2]])
+
+	with jetStore.JetStoreWriter(path) as writer:
+		writer.append({"content": content.astype(np.float32)}, name="a", algorithm="truth")
+		writer.append({"content": content}, name="b", algorithm="truth")
+
+	store = jetStore.JetStore(path)
+	assert store.get("b", "truth")["content"].dtype == np.float64
+	assert np.array_equal(store.get("b", "truth")["content"], content)
+	assert np.array_equal(store.get("a", "truth")["content"], content.astype(np.float32))
+
+
+def test_failed_writer_is_discarded(tmp_path):
+	path = str(tmp_path / "jets.jetstore")
+
+	with pytest.raises(ValueError):
+		with jetStore.JetStoreWriter(path) as writer:
+			writer.append({"content": np.zeros((2, 2))}, name="a", algorithm="truth")
+			writer.append({"content": np.zeros((2, 3))}, name="b", algorithm="truth")
+
+	assert list(tmp_path.iterdir()) == []
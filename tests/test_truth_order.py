@@ -0,0 +1,82 @@
+import pickle
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pytest
+
+from scripts import heatClustermap
+from scripts import heatStats
+from scripts import reclusterTree
+from scripts import treeMetrics
+
+
+def load_truth_jet(name):
+	with open(f"data/{name}_truth.pkl", "rb") as f:
+		jet = pickle.load(f, encoding="latin-1")[0]
+	jet["name"] = name
+
+	return jet
+
+
+def truth_order_heat(reclustered, full_path=False):
+	'''
+	Heat data of a reclustered jet with the rows and columns in the truth jet order, entry by entry: leaf k of the
+	reclustered jet is the truth leaf node_id[k]
+	'''
+	heat = heatClustermap.getHeatData(reclustered)[0 if full_path else 1]
+	position = {truth_leaf: k for k, truth_leaf in enumerate(reclustered["node_id"])}
+	N = len(position)
+
+	return np.array([[heat[position[a], position[b]] for b in range(N)] for a in range(N)])
+
+
+@pytest.fixture(scope="module")
+def jets():
+	truth_jet = load_truth_jet("tree_10")
+	reclustered = reclusterTree.recluster(truth_jet, alpha=-1, save=False)
+
+	# The two conventions (node_id and argsort(node_id)) only agree when node_id is an involution
+	node_id = np.asarray(reclustered["node_id"])
+	assert not np.array_equal(node_id[node_id], np.arange(len(node_id)))
+
+	return truth_jet, reclustered
+
+
+def test_condensed_reorder_follows_order():
+	dense = np.array([[0, 1, 2], [1, 0, 3], [2, 3, 0]])
+	heat = heatClustermap.CondensedHeat(dense[np.triu_indices(3, k=1)], 3)
+	order = np.array([1, 2, 0])
+
+	assert np.array_equal(heat.reorder(order).toarray(), dense[np.ix_(order, order)])
+	assert np.array_equal(heat.reorder(order).reorder(order).toarray(), dense[np.ix_(order[order], order[order])])
+
+
+def test_truth_order(jets):
+	truth_jet, reclustered = jets
+	order = treeMetrics.truth_order(reclustered)
+
+	assert np.array_equal(np.asarray(reclustered["node_id"])[order], np.arange(len(order)))
+
+
+@pytest.mark.parametrize("full_path", [False, True])
+def test_heat_difference_conventions_agree(jets, full_path):
+	truth_jet, reclustered = jets
+	truth_heat = heatClustermap.getHeatData(dict(truth_jet))[0 if full_path else 1]
+	expected = truth_heat - truth_order_heat(reclustered, full_path)
+
+	# Aggregated statistics
+	aggregator = heatStats.HeatDiffAggregator(alpha=-1, full_path=full_path)
+	assert np.array_equal(aggregator.heat_difference(dict(truth_jet)), expected)
+
+	# Metrics
+	N = len(expected)
+	upper = np.triu_indices(N, k=1)
+	heat_mad = treeMetrics.tree_metrics(dict(truth_jet), reclustered, full_path=full_path)[-1]
+	assert heat_mad == pytest.approx(np.mean(np.absolute(expected[upper])))
+
+	# Plotted difference heat map
+	fig = heatClustermap.dendrogramDiff(truthJet=dict(truth_jet), recluster_jet1=reclustered, full_path=full_path,
+	                                    show=False)
+	image = np.asarray(fig.axes[0].images[0].get_array())
+	assert np.array_equal(image, expected)